@@ -0,0 +1,229 @@
+# -*-coding:utf-8-*-
+
+# Speed and accuracy benchmarks for hrcalc and the acquisition loop.
+#
+# Every fixture is a fixed-seed SyntheticPPG recording with a known heart
+# rate and SpO2, cut into overlapping BUFFER_SIZE windows. For each stage
+# the suite reports per-window latency percentiles, windows per second and
+# the peak memory traced while processing one window, then checks that all
+# engines agree and that the estimates stay close to the ground truth.
+#
+#   python benchmark.py                 # full run
+#   python benchmark.py --quick         # fewer windows
+#   python benchmark.py --check         # exit 1 on a correctness regression
+from __future__ import print_function
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import hrcalc
+from heartrate_monitor import HeartRateMonitor
+from max30102 import MAX30102
+from max30102_sim import SimulatedBus, SyntheticPPG
+
+# name, heart rate, SpO2, noise (ADC counts), motion level, and the largest
+# mean absolute errors still accepted by --check (None = report only)
+FIXTURES = [
+    {"name": "rest-clean", "hr": 60, "spo2": 98, "noise": 5, "motion": 0.0, "max_hr_mae": 3, "max_spo2_mae": 1},
+    {"name": "rest", "hr": 72, "spo2": 97, "noise": 10, "motion": 0.0, "max_hr_mae": 5, "max_spo2_mae": 1},
+    {"name": "bradycardia", "hr": 45, "spo2": 99, "noise": 5, "motion": 0.0, "max_hr_mae": 4, "max_spo2_mae": 1},
+    {"name": "tachycardia", "hr": 180, "spo2": 94, "noise": 10, "motion": 0.0, "max_hr_mae": 10, "max_spo2_mae": 2},
+    {"name": "low-spo2", "hr": 80, "spo2": 90, "noise": 10, "motion": 0.0, "max_hr_mae": 5, "max_spo2_mae": 2},
+    {"name": "noisy", "hr": 72, "spo2": 97, "noise": 60, "motion": 0.0, "max_hr_mae": 5, "max_spo2_mae": 4},
+    {"name": "walking", "hr": 95, "spo2": 96, "noise": 20, "motion": 0.1, "max_hr_mae": None, "max_spo2_mae": None},
+    {"name": "motion", "hr": 85, "spo2": 96, "noise": 15, "motion": 0.6, "max_hr_mae": None, "max_spo2_mae": None},
+]
+SEED = 531
+
+
+def make_windows(fixture, num_windows, size=hrcalc.BUFFER_SIZE):
+    """
+    (num_windows, size) IR and Red windows with a hop of one sample.
+    """
+    source = SyntheticPPG(hr=fixture["hr"], spo2=fixture["spo2"], noise=fixture["noise"],
+                          motion=fixture["motion"], sample_rate=hrcalc.SAMPLE_FREQ, seed=SEED)
+    samples = source.read(num_windows + size - 1)
+    windows = np.lib.stride_tricks.sliding_window_view(samples, size, axis=0)
+    return np.ascontiguousarray(windows[:, 1, :]), np.ascontiguousarray(windows[:, 0, :])
+
+
+def time_calls(func, args_list, repeat=1):
+    """
+    Per-call latency in seconds for func(*args) over args_list.
+    """
+    timings = []
+    for _ in range(repeat):
+        for args in args_list:
+            start = time.perf_counter()
+            func(*args)
+            timings.append(time.perf_counter() - start)
+    return np.array(timings)
+
+
+def traced_peak(func, args_list, sample=50):
+    """
+    Mean peak of tracemalloc-traced memory while running func once, in bytes.
+    """
+    peaks = []
+    tracemalloc.start()
+    try:
+        for args in args_list[:sample]:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            func(*args)
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    return float(np.mean(peaks)) if peaks else 0.0
+
+
+def report(name, timings, windows, peak_bytes):
+    p50, p90, p99 = np.percentile(timings, [50, 90, 99]) * 1e6
+    rate = windows / timings.sum() if timings.sum() > 0 else float("inf")
+    row = {"stage": name, "p50_us": p50, "p90_us": p90, "p99_us": p99,
+           "windows_per_s": rate, "peak_kib_per_window": peak_bytes / 1024.0}
+    print("{0:<28} {1:>9.1f} {2:>9.1f} {3:>9.1f} {4:>12.0f} {5:>10.1f}".format(
+        name, p50, p90, p99, rate, peak_bytes / 1024.0))
+    return row
+
+
+def bench_stages(ir, red, repeat):
+    """
+    Latency of every hrcalc stage and of one acquisition loop iteration.
+    """
+    rows = []
+    pairs = [(ir[k], red[k]) for k in range(ir.shape[0])]
+    n = len(pairs)
+
+    print("{0:<28} {1:>9} {2:>9} {3:>9} {4:>12} {5:>10}".format(
+        "stage", "p50 us", "p90 us", "p99 us", "windows/s", "peak KiB"))
+
+    vec = lambda i, r: hrcalc.calc_hr_and_spo2(i, r, vectorized=True)
+    rows.append(report("calc_hr_and_spo2 (numpy)", time_calls(vec, pairs, repeat), n * repeat,
+                       traced_peak(vec, pairs)))
+    loop_args = [(i.tolist(), r.tolist()) for i, r in pairs]
+    ref = lambda i, r: hrcalc.calc_hr_and_spo2(i, r, vectorized=False)
+    rows.append(report("calc_hr_and_spo2 (loop)", time_calls(ref, loop_args, repeat), n * repeat,
+                       traced_peak(ref, loop_args)))
+
+    # the whole stack in one call, reported per window
+    batch = time_calls(hrcalc.calc_hr_and_spo2_batch, [(ir, red)], repeat) / n
+    rows.append(report("calc_hr_and_spo2_batch", np.repeat(batch, n), n * repeat,
+                       traced_peak(hrcalc.calc_hr_and_spo2_batch, [(ir, red)]) / n))
+
+    # peak detection on the signal calc_hr_and_spo2 would hand it
+    signals = []
+    for i, _ in pairs:
+        x = int(np.mean(i)) - i
+        sums = np.convolve(x, np.ones(hrcalc.MA_SIZE, dtype=np.int64), mode="valid")
+        x[:-hrcalc.MA_SIZE] = sums[:-1] / hrcalc.MA_SIZE
+        signals.append(x)
+    peak_args = [(x, hrcalc.BUFFER_SIZE, min(max(int(np.mean(x)), 30), 60), 4, 15) for x in signals]
+    rows.append(report("find_peaks", time_calls(hrcalc.find_peaks, peak_args, repeat), n * repeat,
+                       traced_peak(hrcalc.find_peaks, peak_args)))
+    close_args = []
+    for x, size, th, dist, num in peak_args:
+        locs, n_peaks = hrcalc.find_peaks_above_min_height(x, size, th, num)
+        close_args.append((n_peaks, locs, x, dist))
+    rows.append(report("remove_close_peaks", time_calls(hrcalc.remove_close_peaks, close_args, repeat),
+                       n * repeat, traced_peak(hrcalc.remove_close_peaks, close_args)))
+
+    # one run_sensor iteration: a new sample lands in the FIFO, gets drained
+    # in a burst and pushed through the sliding window estimator
+    source = SyntheticPPG(seed=SEED)
+    bus = SimulatedBus(source, realtime=False)
+    sensor = MAX30102(bus=bus)
+    hrm = HeartRateMonitor(bus=bus)
+    bus.advance(hrcalc.BUFFER_SIZE)
+    while bus.fifo_count:
+        samples = sensor.read_fifo_burst()
+        hrm.add_samples(samples[:, 0], samples[:, 1])
+
+    def iteration():
+        bus.advance(1)
+        samples = sensor.read_fifo_burst()
+        hrm.add_samples(samples[:, 0], samples[:, 1])
+
+    it_args = [()] * n
+    rows.append(report("run_sensor iteration", time_calls(iteration, it_args, repeat), n * repeat,
+                       traced_peak(iteration, it_args)))
+    return rows
+
+
+def check_accuracy(fixtures, num_windows):
+    """
+    Compare engines against each other and estimates against ground truth.
+    Returns a list of failure messages.
+    """
+    failures = []
+    print("{0:<12} {1:>5} {2:>5} {3:>8} {4:>8} {5:>9} {6:>9}  {7}".format(
+        "fixture", "hr", "spo2", "hr ok%", "spo2 ok%", "hr MAE", "spo2 MAE", "engines"))
+    for fixture in fixtures:
+        ir, red = make_windows(fixture, num_windows)
+        hr, hr_valid, spo2, spo2_valid = hrcalc.calc_hr_and_spo2_batch(ir, red)
+
+        # single-window engines must match the batch result bit for bit
+        agree = True
+        for k in range(0, ir.shape[0], max(1, ir.shape[0] // 50)):
+            expected = (int(hr[k]), bool(hr_valid[k]),
+                        float(spo2[k]) if spo2_valid[k] else -999, bool(spo2_valid[k]))
+            if hrcalc.calc_hr_and_spo2(ir[k], red[k], vectorized=True) != expected or \
+                    hrcalc.calc_hr_and_spo2(ir[k].tolist(), red[k].tolist(), vectorized=False) != expected:
+                agree = False
+                break
+
+        hr_mae = float(np.abs(hr[hr_valid] - fixture["hr"]).mean()) if hr_valid.any() else float("nan")
+        spo2_mae = float(np.abs(spo2[spo2_valid] - fixture["spo2"]).mean()) if spo2_valid.any() else float("nan")
+        print("{0:<12} {1:>5} {2:>5} {3:>8.1f} {4:>8.1f} {5:>9.2f} {6:>9.2f}  {7}".format(
+            fixture["name"], fixture["hr"], fixture["spo2"], hr_valid.mean() * 100, spo2_valid.mean() * 100,
+            hr_mae, spo2_mae, "match" if agree else "MISMATCH"))
+
+        if not agree:
+            failures.append("{0}: engines disagree".format(fixture["name"]))
+        if fixture["max_hr_mae"] is not None and not hr_mae <= fixture["max_hr_mae"]:
+            failures.append("{0}: hr MAE {1:.2f} > {2}".format(fixture["name"], hr_mae, fixture["max_hr_mae"]))
+        if fixture["max_spo2_mae"] is not None and not spo2_mae <= fixture["max_spo2_mae"]:
+            failures.append("{0}: spo2 MAE {1:.2f} > {2}".format(fixture["name"], spo2_mae, fixture["max_spo2_mae"]))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hrcalc and the acquisition loop")
+    parser.add_argument("-n", "--windows", type=int, default=500,
+                        help="windows per fixture, default 500")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="timing repetitions, default 3")
+    parser.add_argument("--quick", action="store_true", help="100 windows, 1 repetition")
+    parser.add_argument("--check", action="store_true",
+                        help="exit with status 1 if engines disagree or accuracy regresses")
+    parser.add_argument("--json", default=None, help="also write the results to this file")
+    args = parser.parse_args()
+    if args.quick:
+        args.windows, args.repeat = 100, 1
+
+    print("== speed ({0} windows x {1}) ==".format(args.windows, args.repeat))
+    ir, red = make_windows(FIXTURES[1], args.windows)
+    rows = bench_stages(ir, red, args.repeat)
+
+    print()
+    print("== accuracy ({0} windows per fixture) ==".format(args.windows))
+    failures = check_accuracy(FIXTURES, args.windows)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"speed": rows, "failures": failures}, f, indent=2)
+
+    if failures:
+        print()
+        for failure in failures:
+            print("FAIL", failure)
+    if args.check and failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import hashlib
+import random
+import re
+import time
+
+
+class FakeAPIError(Exception):
+    """
+    Raised by FakeGeminiModel, with an HTTP status in `code` like the
+    google.api_core exceptions (429 quota exhausted, 503 unavailable).
+    """
+
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class FakeResponse(object):
+    """
+    The parts of a google.generativeai response the dashboard uses.
+    Iterating gives the text in chunks, as a streamed response does.
+    """
+
+    def __init__(self, text, chunks=None, delay=0.0):
+        self.text = text
+        self._chunks = chunks or [text]
+        self._delay = delay
+
+    def resolve(self):
+        pass
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            if self._delay:
+                time.sleep(self._delay)
+            yield FakeResponse(chunk)
+
+
+class FakeGeminiModel(object):
+    """
+    Stand-in for genai.GenerativeModel that needs no API key or network.
+
+    Answers are deterministic (derived from a hash of the prompt) and
+    arrive after `latency` seconds. Failures can be injected to exercise
+    caching, retries and the circuit breaker locally: every `fail_every`-th
+    call, a random `failure_rate` of calls, or every call from now until
+    `outage_until` (time.time()) raise FakeAPIError with `error_code`. With
+    stream=True the latency is spread over the chunks of the answer. A
+    batched prompt (see GeminiClient.generate_batch) gets one marked answer
+    per request. calls and prompts record what was asked.
+    """
+
+    def __init__(self, latency=0.0, fail_every=0, failure_rate=0.0, error_code=429, outage_until=None,
+                 chunk_words=4, seed=None):
+        self.latency = latency
+        self.fail_every = fail_every
+        self.failure_rate = failure_rate
+        self.error_code = error_code
+        self.outage_until = outage_until
+        self.chunk_words = chunk_words
+        self.calls = 0
+        self.prompts = []
+        self._random = random.Random(seed)
+
+    def _answer(self, prompt):
+        digest = hashlib.sha256(prompt.encode()).hexdigest()[:8]
+        return (f"- Fake insight {digest}: your readings look steady.\n"
+                f"- (offline test response #{self.calls}, {len(prompt)} prompt characters)")
+
+    def generate_content(self, prompt, stream=False):
+        self.calls += 1
+        self.prompts.append(prompt)
+        if ((self.fail_every and self.calls % self.fail_every == 0) or
+                (self.failure_rate and self._random.random() < self.failure_rate) or
+                (self.outage_until is not None and time.time() < self.outage_until)):
+            raise FakeAPIError(self.error_code, f"fake Gemini failure on call {self.calls}")
+        requests = re.split(r"^### Request \d+\s*$", prompt, flags=re.MULTILINE)[1:]
+        if requests:
+            text = "\n\n".join(f"### Answer {k}\n{self._answer(request)}" for k, request in enumerate(requests, 1))
+        else:
+            text = self._answer(prompt)
+        if not stream:
+            if self.latency:
+                time.sleep(self.latency)
+            return FakeResponse(text)
+        words = text.split(" ")
+        chunks = [" ".join(words[k:k + self.chunk_words]) + " " for k in range(0, len(words), self.chunk_words)]
+        chunks[-1] = chunks[-1].rstrip(" ")
+        return FakeResponse(text, chunks, self.latency / len(chunks))
@@ -1,12 +1,14 @@
-import paho.mqtt.client as mqtt
-import time
 import json
-import sqlite3
+import os
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from datetime import datetime, timedelta
+from fake_gemini import FakeGeminiModel
+from gemini_cache import GeminiResponseCache, fingerprint
+from gemini_client import GeminiClient
+from health_db import MAX_POINTS, from_epoch_ms, to_epoch_ms
+from ingest_service import IngestService
+from llm_executor import LLMExecutor
+from prompt_features import build_prompt_features, format_features
 
 # Default color palette from the VitalitySync image
 DEFAULT_COLORS = {
@@ -85,103 +87,110 @@ from gemini_ai_call import *
 from gemini_myapi import *
 
 # Importing the necessary functions for the Gemini API LLM Interaction to Work
+# GEMINI_FAKE=1 swaps in a local stub, for running the dashboard without an
+# API key or quota
 def __get_gemini_client__() -> genai.GenerativeModel:
+    if os.getenv("GEMINI_FAKE") == "1":
+        return FakeGeminiModel(latency=float(os.getenv("GEMINI_FAKE_LATENCY", "0.5")))
     genai.configure(api_key=the_api_key)
     gemini_model = genai.GenerativeModel("gemini-1.5-flash")
     return gemini_model
 
-gemini_model = __get_gemini_client__()
-
-# MQTT setup
-def on_connect(client, userdata, flags, rc):
-    if rc == 0:
-        print("Successfully connected to broker")
-        client.subscribe("health_sensor/data")
-    else:
-        print(f"Connection failed with code {rc}")
-
-def on_message(client, userdata, msg):
-    data = json.loads(msg.payload.decode())
-    store_current_values(data)
-    print(f"Received data (Context: {data['context']}): {data}")
-
-# SQLite functions
-def store_current_values(data):
-    conn = sqlite3.connect("health_data.db")
-    c = conn.cursor()
-    timestamp = data["timestamp"]
-    context = data["context"]
-    for metric, value in data.items():
-        if metric not in ["timestamp", "context"]:
-            c.execute("INSERT INTO current_values (timestamp, metric, value, context) VALUES (?, ?, ?, ?)", 
-                      (timestamp, metric, value, context))
-    conn.commit()
-    conn.close()
-
-def fetch_resting_values():
-    conn = sqlite3.connect("health_data.db")
-    c = conn.cursor()
-    c.execute("SELECT metric, value FROM resting_values")
-    resting = dict(c.fetchall())
-    conn.close()
-    return resting
-
-def fetch_latest_current_values():
-    conn = sqlite3.connect("health_data.db")
-    c = conn.cursor()
-    c.execute("SELECT metric, value, context FROM current_values WHERE timestamp = (SELECT MAX(timestamp) FROM current_values)")
-    latest = c.fetchall()
-    conn.close()
-    return {metric: (value, context) for metric, value, context in latest}
-
-def fetch_historical_data(metric, time_range_hours):
-    conn = sqlite3.connect("health_data.db")
-    c = conn.cursor()
-    end_time = datetime.now()
-    start_time = end_time - timedelta(hours=time_range_hours)
-    c.execute("SELECT timestamp, value, context FROM current_values WHERE metric = ? AND timestamp >= ? ORDER BY timestamp", 
-              (metric, start_time.isoformat()))
-    data = c.fetchall()
-    conn.close()
-    return pd.DataFrame(data, columns=["Timestamp", "Value", "Context"]).sort_values("Timestamp")
-
-def fetch_recent_data(metric, limit=10):
-    conn = sqlite3.connect("health_data.db")
-    c = conn.cursor()
-    c.execute("SELECT timestamp, value, context FROM current_values WHERE metric = ? ORDER BY timestamp DESC LIMIT ?", 
-              (metric, limit))
-    data = c.fetchall()
-    conn.close()
-    return pd.DataFrame(data, columns=["Timestamp", "Value", "Context"]).sort_values("Timestamp")
+# Gemini answers are cached on disk across sessions and restarts, keyed on
+# the question and the readings rounded into buckets, so asking the same
+# thing again costs no API call
+@st.cache_resource
+def get_response_cache():
+    return GeminiResponseCache()
+
+response_cache = get_response_cache()
+
+# One client per server process, so every session shares its rate limit
+# (GEMINI_RPM requests a minute), retries and circuit breaker.
+# GEMINI_BATCH_WINDOW > 0 joins requests from several sessions arriving
+# within that many seconds into one call, at the cost of streaming
+@st.cache_resource
+def get_gemini_model():
+    return GeminiClient(__get_gemini_client__(), rate=float(os.getenv("GEMINI_RPM", "15")) / 60.0,
+                        cache=response_cache, batch_window=float(os.getenv("GEMINI_BATCH_WINDOW", "0")))
+
+gemini_model = get_gemini_model()
+
+# Gemini calls run on worker threads: a form submit only queues the request
+# and the answer streams into a response fragment, so the live sections keep
+# refreshing while Gemini works. Identical questions in flight share a call
+@st.cache_resource
+def get_llm_executor():
+    return LLMExecutor(gemini_model, workers=gemini_model.max_batch, timeout=60.0, cache=response_cache,
+                       batch=gemini_model.batch_window > 0)
+
+llm = get_llm_executor()
+
+# MQTT ingest
+# One subscriber per server process, shared by every browser session: each
+# reading is written to SQLite once (batched, with the insight detector) and
+# added once to the in-memory cache the sections below read from
+@st.cache_resource
+def get_ingest_service():
+    return IngestService().start()
 
 def get_available_metrics():
-    conn = sqlite3.connect("health_data.db")
-    c = conn.cursor()
-    c.execute("SELECT DISTINCT metric FROM resting_values")
-    metrics = [row[0] for row in c.fetchall()]
-    conn.close()
-    return metrics
-
-# Function to detect interesting data points
-def detect_interesting_insights():
-    insights = []
-    metrics = ["Heart_Rate", "Body_Temperature"]
-    for metric in metrics:
-        df = fetch_recent_data(metric, 10)
-        if len(df) < 2:
-            continue
-        
-        # Calculate the difference between consecutive readings
-        df["Diff"] = df["Value"].diff().abs()
-        max_diff = df["Diff"].max()
-        threshold = {"Heart_Rate": 10, "Body_Temperature": 1}  # Thresholds for significant changes
-        
-        if metric in threshold and max_diff > threshold[metric]:
-            latest_value = df["Value"].iloc[-1]
-            timestamp = df["Timestamp"].iloc[-1]
-            insights.append(f"Significant change in {metric}: {latest_value:.2f} at {timestamp} (change of {max_diff:.2f})")
-    
-    return insights
+    return cache.available_metrics()
+
+# Trend chart: one column per context so each keeps its colour
+CONTEXTS = ["resting", "running", "walking", "exercising"]
+
+def to_chart_frame(df, metric):
+    wide = df.assign(Timestamp=pd.to_datetime(df["Timestamp"])).pivot_table(
+        index="Timestamp", columns="Context", values="Value", aggfunc="mean")
+    return wide.reindex(columns=CONTEXTS).rename(columns=lambda c: f"{metric} ({c.capitalize()})")
+
+def chart_end(latest_ts, resolution):
+    # last timestamp whose point is final: a rollup bucket still filling up
+    # would change after it has been appended
+    if not resolution:
+        return latest_ts
+    width = resolution * 1000
+    return latest_ts - latest_ts % width - 1
+
+def trend_frame(state, metric, hours):
+    """
+    Chart frame for metric over the last `hours` up to the newest complete
+    point. It is loaded once per metric and range at a fixed resolution;
+    after that each call only adds the points completed since the previous
+    one and trims what slid out of the range, and returns the same frame
+    object when neither happened.
+    """
+    latest_ts = cache.latest_timestamp()
+    if not metric or latest_ts is None:
+        return None
+    key = (metric, hours)
+    if key != state.get("key") or len(state["frame"]) > MAX_POINTS * 1.1:
+        resolution = cache.resolution_for(metric, hours, end=latest_ts)
+        if resolution is None:
+            return None
+        end = chart_end(latest_ts, resolution)
+        df = cache.history(metric, hours, end=end, resolution=resolution)
+        state.update(key=key, resolution=resolution, end=end, frame=to_chart_frame(df, metric))
+        return state["frame"]
+
+    end = chart_end(latest_ts, state["resolution"])
+    if end > state["end"]:
+        df = cache.history(metric, (end - state["end"]) / 3600000.0, end=end, resolution=state["resolution"])
+        # rows and buckets up to state["end"] are already in the frame
+        df = df[df["Timestamp"].map(to_epoch_ms) > state["end"]]
+        frame = state["frame"]
+        if not df.empty:
+            frame = pd.concat([frame, to_chart_frame(df, metric)])
+        # same first row as a fresh load: the bucket holding the range start
+        start = end - int(hours * 3600 * 1000)
+        if state["resolution"]:
+            start -= start % (state["resolution"] * 1000)
+        start = pd.Timestamp(from_epoch_ms(start))
+        if len(frame) and frame.index[0] < start:
+            frame = frame[frame.index >= start]
+        state.update(end=end, frame=frame)
+    return state["frame"]
 
 # Streamlit UI
 # Sidebar for customization and logo
@@ -211,6 +220,9 @@ with st.sidebar:
         colors["card_bg"] = "#4A919E"  # Teal
         colors["card_text"] = "#FFFFFF"  # White
 
+    with st.expander("Gemini usage"):
+        st.json(gemini_model.metrics())
+
 # Apply the styles
 apply_styles(colors)
 
@@ -218,14 +230,14 @@ apply_styles(colors)
 st.image("essentials/images/VitalitySync_Logo.png", use_container_width=True)  # Reverted to requested path and parameter
 st.markdown(f"**Stay Ahead, Stay Healthy** - Reducing hospital wait times by empowering you with real-time health insights and a supportive health buddy.")
 
-# Initialize MQTT client
-if "mqtt_client" not in st.session_state:
-    st.session_state.mqtt_client = mqtt.Client()
-    st.session_state.mqtt_client.on_connect = on_connect
-    st.session_state.mqtt_client.on_message = on_message
-    st.session_state.mqtt_client.connect("broker.hivemq.com", 1883, 60)
-    st.session_state.mqtt_client.loop_start()
+# Start ingest before the first query; its writer creates the tables and
+# migrates an older database
+ingest = get_ingest_service()
+cache = ingest.cache
+if ingest.connected:
     st.write("Connected to MQTT broker and listening for sensor data...")
+else:
+    st.write("Connecting to MQTT broker...")
 
 # Initialize session state for static widgets
 if "metric_to_plot" not in st.session_state:
@@ -233,7 +245,7 @@ if "metric_to_plot" not in st.session_state:
 if "time_range" not in st.session_state:
     st.session_state.time_range = 24
 
-# Static widgets outside the loop
+# Static widgets
 st.header("📈 Historical Trends")
 col1, col2 = st.columns([3, 1])
 with col1:
@@ -242,149 +254,188 @@ with col2:
     # Let Streamlit manage the session state automatically via the key
     st.slider("Time Range (hours)", 1, 24, 24, key="time_range")
 
-# Main content loop for dynamic updates
-placeholder = st.empty()
-while True:
-    with placeholder.container():
-        # Section 1: Live Sensor Readings
-        st.header("📊 Live Sensor Readings")
-        latest_values = fetch_latest_current_values()
-        if latest_values:
-            context = list(latest_values.values())[0][1]  # Get context from the latest data
-            st.subheader(f"Current Context: {context.capitalize()}")
-            
-            cols = st.columns(3)
-            with cols[0]:
-                st.metric("Heart Rate", f"{latest_values.get('Heart_Rate', (0, ''))[0]:.2f} BPM")
-            with cols[1]:
-                st.metric("Temperature", f"{latest_values.get('Body_Temperature', (0, ''))[0]:.2f} °C")
-            with cols[2]:
-                accel_x = latest_values.get("Accel_X", (0, ""))[0]
-                accel_y = latest_values.get("Accel_Y", (0, ""))[0]
-                accel_z = latest_values.get("Accel_Z", (0, ""))[0]
-                st.metric("Accelerometer (X, Y, Z)", f"{accel_x:.2f}, {accel_y:.2f}, {accel_z:.2f} g")
-
-        # Section 2: Interesting Insights
-        st.header("🔍 Interesting Insights")
-        insights = detect_interesting_insights()
-        if insights:
-            for insight in insights:
-                st.markdown(f"<div class='insight-box'>{insight}</div>", unsafe_allow_html=True)
-        else:
-            st.write("No significant changes detected recently.")
-
-        # Section 3: Historical Trends (Graph Rendering)
-        metric_to_plot = st.session_state.metric_to_plot
-        time_range = st.session_state.time_range  # Access the value directly
-        
-        if metric_to_plot:
-            # Fetch data for the past time_range hours
-            df = fetch_historical_data(metric_to_plot, time_range)
-            if not df.empty:
-                # For demo: Filter the most recent 60 seconds of data
-                df["Timestamp"] = pd.to_datetime(df["Timestamp"])
-                latest_time = df["Timestamp"].max()
-                start_time = latest_time - timedelta(seconds=60)
-                df = df[(df["Timestamp"] >= start_time) & (df["Timestamp"] <= latest_time)]
-                
-                if not df.empty:
-                    # Convert timestamps to seconds relative to the start time
-                    df["Seconds"] = (df["Timestamp"] - start_time).dt.total_seconds()
-                    
-                    # Create the graph
-                    fig, ax = plt.subplots(figsize=(10, 5))
-                    
-                    # Plot with different colors for resting vs. changing states
-                    for context in df["Context"].unique():
-                        color = colors["resting"] if context == "resting" else colors["changing"]
-                        label = f"{metric_to_plot} ({context.capitalize()})"
-                        subset = df[df["Context"] == context]
-                        sns.lineplot(data=subset, x="Seconds", y="Value", marker="o", color=color, label=label, ax=ax)
-                    
-                    # Customize the graph
-                    ax.set_title(f"{metric_to_plot} Over Last Minute", fontsize=14, pad=15)
-                    ax.set_xlabel("Time (seconds)", fontsize=12)
-                    ax.set_ylabel(metric_to_plot, fontsize=12)
-                    ax.grid(True, linestyle="--", alpha=0.7)
-                    ax.legend()
-                    plt.xticks(fontsize=10)
-                    plt.yticks(fontsize=10)
-                    plt.tight_layout()
-                    st.pyplot(fig)
-
-        # Section 4: Gemini AI Insights
-        st.header("🤖 AI-Driven Health Insights")
-        with st.expander("Request Insights", expanded=True):
-            with st.form("insights_form"):
-                user_input = st.text_input("What would you like to know about your health?", placeholder="Tell me about my health!", key="user_input_insights")
-                metrics = st.multiselect("Which metrics?", get_available_metrics(), default=get_available_metrics(), key="metrics_select")
-                context = st.selectbox("What were you doing?", ["resting", "running", "walking", "exercising"], key="context_select")
-                submit_button = st.form_submit_button("Get Insights")
-
-                if submit_button and user_input.lower() == "tell me about my health!":
-                    if not metrics or not context:
-                        st.error("Please select both metrics and context!")
-                    else:
-                        resting_values = fetch_resting_values()
-                        current_subset = {k: v[0] for k, v in latest_values.items() if k in metrics}
-                        
-                        # Structured prompt for LLM
-                        prompt = f"""
-                        You are Gemini, a friendly health AI assistant.
-                        
-                        A patient is using a personal health sensor and has provided the following data.
-                        
-                        Please provide general advice and insights based on this data and the current context. 
-                        Compare the user's current health metrics with their resting values and provide structured insights based on the context '{context}'.
-                        
-                        Structure your response clearly using bullet points for each metric.
-                            
-                        Do not give medical diagnoses or treatment recommendations.
-                        If any values are outside of typical ranges for their current activity, mention that the patient should consult with a healthcare professional.
-                        Be respectful and avoid alarming language.
-
-                        Resting Values: {json.dumps(resting_values)}
-                        Current Values: {json.dumps(current_subset)}
-                        Context: {context}
-                        """
-                        response = gemini_model.generate_content(prompt).text
-                        st.subheader("Gemini's Insights:")
-                        st.write(response)
-
-        # Section 5: Extra Insights
-        st.header("🔎 Request Extra Insights")
-        with st.expander("Ask for More Details", expanded=False):
-            with st.form("extra_insights_form"):
-                extra_query = st.text_area("Ask a specific question about your health data:", placeholder="E.g., Why did my heart rate spike during running?", key="extra_query_input")
-                submit_extra = st.form_submit_button("Get Extra Insights")
-
-                if submit_extra and extra_query:
-                    recent_data = {}
-                    for metric in get_available_metrics():
-                        df = fetch_recent_data(metric, 20)
-                        recent_data[metric] = df.to_dict()
-
+# Live sections. Each runs as a fragment on its own timer, so a tick only
+# reruns that section instead of the whole script.
+def live_readings():
+    # Section 1: Live Sensor Readings
+    st.header("📊 Live Sensor Readings")
+    latest_values = cache.latest()
+    if latest_values:
+        context = list(latest_values.values())[0][1]  # Get context from the latest data
+        st.subheader(f"Current Context: {context.capitalize()}")
+
+        cols = st.columns(3)
+        with cols[0]:
+            st.metric("Heart Rate", f"{latest_values.get('Heart_Rate', (0, ''))[0]:.2f} BPM")
+        with cols[1]:
+            st.metric("Temperature", f"{latest_values.get('Body_Temperature', (0, ''))[0]:.2f} °C")
+        with cols[2]:
+            accel_x = latest_values.get("Accel_X", (0, ""))[0]
+            accel_y = latest_values.get("Accel_Y", (0, ""))[0]
+            accel_z = latest_values.get("Accel_Z", (0, ""))[0]
+            st.metric("Accelerometer (X, Y, Z)", f"{accel_x:.2f}, {accel_y:.2f}, {accel_z:.2f} g")
+
+def interesting_insights():
+    # Section 2: Interesting Insights
+    st.header("🔍 Interesting Insights")
+    insights = cache.recent_events()
+    if insights:
+        for insight in insights:
+            st.markdown(f"<div class='insight-box'>{insight.message}</div>", unsafe_allow_html=True)
+    else:
+        st.write("No significant changes detected recently.")
+
+def trend_chart(area, metric, hours, colors):
+    # Section 3: Historical Trends (Graph Rendering)
+    # Drawn into `area`, an st.empty from outside the fragment: the fragment's
+    # own elements are cleared on every tick, the area keeps its chart until
+    # replaced. So a tick that added no points leaves the chart as it is; a
+    # full rerun passes a new, empty area and draws again
+    state = st.session_state.setdefault("trend_state", {})
+    frame = trend_frame(state, metric, hours)
+    if frame is None:
+        return
+    drawn = state.get("drawn")
+    if drawn is not None and drawn[0] is area and drawn[1] is frame:
+        return
+    with area.container():
+        st.subheader(f"{metric} Over Last {hours} Hour(s)")
+        st.line_chart(frame, color=[colors["resting"] if c == "resting" else colors["changing"] for c in CONTEXTS])
+    state["drawn"] = (area, frame)
+
+# The AI forms are fragments without a timer: they render once, and
+# submitting one reruns only that form
+@st.fragment
+def insights_form():
+    # Section 4: Gemini AI Insights
+    st.header("🤖 AI-Driven Health Insights")
+    with st.expander("Request Insights", expanded=True):
+        with st.form("insights_form"):
+            user_input = st.text_input("What would you like to know about your health?", placeholder="Tell me about my health!", key="user_input_insights")
+            metrics = st.multiselect("Which metrics?", get_available_metrics(), default=get_available_metrics(), key="metrics_select")
+            context = st.selectbox("What were you doing?", ["resting", "running", "walking", "exercising"], key="context_select")
+            submit_button = st.form_submit_button("Get Insights")
+
+            if submit_button and user_input.lower() == "tell me about my health!":
+                if not metrics or not context:
+                    st.error("Please select both metrics and context!")
+                else:
+                    resting_values = cache.resting_values()
+                    current_subset = {k: v[0] for k, v in cache.latest().items() if k in metrics}
+
+                    # Structured prompt for LLM
                     prompt = f"""
                     You are Gemini, a friendly health AI assistant.
                     
-                    A patient is using a personal health sensor and has the following recent data:
-                    {json.dumps(recent_data)}
+                    A patient is using a personal health sensor and has provided the following data.
                     
-                    The patient has asked the following question: "{extra_query}"
+                    Please provide general advice and insights based on this data and the current context. 
+                    Compare the user's current health metrics with their resting values and provide structured insights based on the context '{context}'.
                     
-                    Provide a detailed, conversational response to the patient's question. Use the recent data to support your insights. Be clear, respectful, and avoid alarming language. Do not provide medical diagnoses or treatment recommendations. If the data suggests something unusual, recommend consulting a healthcare professional.
-                    """
-                    response = gemini_model.generate_content(prompt).text
-                    st.subheader("Extra Insights:")
-                    st.write(response)
-
-    time.sleep(refresh_rate)
-
-# Stop MQTT client when the app is closed
-def on_app_close():
-    if "mqtt_client" in st.session_state:
-        st.session_state.mqtt_client.loop_stop()
-        st.session_state.mqtt_client.disconnect()
-        print("MQTT client disconnected")
+                    Structure your response clearly using bullet points for each metric.
+                        
+                    Do not give medical diagnoses or treatment recommendations.
+                    If any values are outside of typical ranges for their current activity, mention that the patient should consult with a healthcare professional.
+                    Be respectful and avoid alarming language.
 
-st.on_session_end(on_app_close)
\ No newline at end of file
+                    Resting Values: {json.dumps(resting_values)}
+                    Current Values: {json.dumps(current_subset)}
+                    Context: {context}
+                    """
+                    key = fingerprint("insights", question=user_input, context=context,
+                                      resting=resting_values, current=current_subset)
+                    st.session_state.insights_request = llm.submit(prompt, key, "insights")
+                    # a full rerun, so the response fragment below starts polling
+                    st.rerun()
+
+@st.fragment
+def extra_insights_form():
+    # Section 5: Extra Insights
+    st.header("🔎 Request Extra Insights")
+    with st.expander("Ask for More Details", expanded=False):
+        with st.form("extra_insights_form"):
+            extra_query = st.text_area("Ask a specific question about your health data:", placeholder="E.g., Why did my heart rate spike during running?", key="extra_query_input")
+            lookback = st.select_slider("Look back over (hours)", options=[0.25, 1, 3, 6, 12, 24], value=1, key="extra_lookback")
+            submit_extra = st.form_submit_button("Get Extra Insights")
+
+            if submit_extra and extra_query:
+                # a few lines of statistics per metric (read from the
+                # rollups) instead of the raw readings, so hours of data fit
+                # in a short prompt
+                features = build_prompt_features(cache, get_available_metrics(), lookback, end=cache.latest_timestamp())
+                # the answer depends on the levels, activities and anomalies,
+                # not on the exact values, so those make the cache key (the
+                # levels are bucketed by the metric they are under)
+                summary = {metric: {"levels": [f["mean"], f["min"], f["max"], f["last"]],
+                                    "contexts": [s["context"] for s in f["segments"]],
+                                    "anomalies": [a["kind"] for a in f["anomalies"]]}
+                           for metric, f in features.items()}
+
+                prompt = f"""
+                You are Gemini, a friendly health AI assistant.
+                
+                A patient is using a personal health sensor. Summary of their data over the last {lookback} hour(s), per metric (trend is the change per hour; activities are in time order; anomalies were flagged by the sensor pipeline):
+                {format_features(features)}
+                
+                The patient has asked the following question: "{extra_query}"
+                
+                Provide a detailed, conversational response to the patient's question. Use the recent data to support your insights. Be clear, respectful, and avoid alarming language. Do not provide medical diagnoses or treatment recommendations. If the data suggests something unusual, recommend consulting a healthcare professional.
+                """
+                key = fingerprint("extra_insights", question=extra_query, hours=str(lookback), recent=summary)
+                st.session_state.extra_insights_request = llm.submit(prompt, key, "extra_insights")
+                # a full rerun, so the response fragment below starts polling
+                st.rerun()
+
+def response_poll(state_key):
+    # The response fragments only rerun on a timer while their request is
+    # unfinished; otherwise they draw once like the forms
+    request = st.session_state.get(state_key)
+    return RESPONSE_POLL if request is not None and not request.done() else None
+
+def llm_response(state_key, title, polling):
+    # Shows the request a form left in session state, as far as it has got
+    request = st.session_state.get(state_key)
+    if request is None:
+        return
+    if request.status in ("pending", "running") and st.button("Cancel", key=f"{state_key}_cancel"):
+        request.cancel()
+    status = request.status
+    if polling and status not in ("pending", "running"):
+        # finished: redraw the page so this fragment stops polling
+        st.rerun()
+    st.subheader(title)
+    if status in ("pending", "running"):
+        st.caption("Gemini is answering...")
+    elif request.cached:
+        st.caption("Answered from cache")
+    if request.text:
+        st.write(request.text)
+    if status == "failed":
+        st.error(f"Gemini request failed: {request.error}")
+    elif status == "timed_out":
+        st.warning("Gemini took too long to answer, please try again.")
+    elif status == "cancelled":
+        st.info("Request cancelled.")
+
+# Insight events change far less often than the live readings, and the chart
+# only gains a point when a sample or rollup bucket completes, so neither
+# needs to rerun faster than that
+INSIGHTS_REFRESH = 5
+# how often an unfinished Gemini answer is redrawn
+RESPONSE_POLL = 0.5
+
+st.fragment(run_every=refresh_rate)(live_readings)()
+st.fragment(run_every=max(refresh_rate, INSIGHTS_REFRESH))(interesting_insights)()
+metric_to_plot = st.session_state.metric_to_plot
+time_range = st.session_state.time_range
+latest_ts = cache.latest_timestamp()
+chart_resolution = cache.resolution_for(metric_to_plot, time_range, end=latest_ts) if metric_to_plot and latest_ts else None
+chart_every = max(refresh_rate, chart_resolution or 0)
+chart_area = st.empty()
+st.fragment(run_every=chart_every)(trend_chart)(chart_area, metric_to_plot, time_range, colors)
+insights_form()
+poll = response_poll("insights_request")
+st.fragment(run_every=poll)(llm_response)("insights_request", "Gemini's Insights:", poll is not None)
+extra_insights_form()
+poll = response_poll("extra_insights_request")
+st.fragment(run_every=poll)(llm_response)("extra_insights_request", "Extra Insights:", poll is not None)
@@ -1,31 +1,147 @@
 import google.generativeai as genai
-from typing import List, Optional
+from collections import deque
+from typing import Callable, List, Optional, Union
 
-# # Function to query Gemini API (Text)
-# Conversation history (list of dictionaries)
-conversation_history = []
 
-def query_gemini_api(user_text: str, gemini_model: genai.GenerativeModel, history: list) -> str:
-    """Queries the Gemini API, including conversation history."""
-    try:
-        prompt = user_text  # Start with the user's text
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token for English text)."""
+    return len(text) // 4 + 1
 
-        # Adding conversation history to the prompt (if any); Modified with Gemini AI on 4 Feb 25 @ 1:35pm
-        if history:
-            formatted_history = ""
-            for turn in history:
-                formatted_history += f"User: {turn['user']}\nGemini: {turn['gemini']}\n"
 
-            prompt = formatted_history + prompt  # Prepend history to current prompt
+def format_turn(user_text: str, gemini_text: str) -> str:
+    return f"User: {user_text}\nGemini: {gemini_text}\n"
 
-        response = gemini_model.generate_content(prompt)
-        response.resolve()
-        gemini_response = response.text
 
-        # Update conversation history
-        history.append({"user": user_text, "gemini": gemini_response})
+# ends the summary when turns had to be dropped without summarizing them
+OMITTED_MARKER = "(Some earlier turns were left out.)"
+
+
+class ConversationHistory(object):
+    """
+    Conversation history with a bounded prompt.
+
+    Keeps at most max_turns turns and max_tokens (estimated) of them; older
+    turns drop off the front. With a summarizer (a function of the text and
+    a token limit returning a summary within it, see gemini_summarizer)
+    dropped turns are folded into a running summary that leads the prompt
+    instead of being lost; if it fails, the turns are kept for a later try.
+    Each turn is formatted once when it is added and the prompt prefix is
+    kept between calls, so the cost of a call does not grow with the
+    session.
+    """
+
+    def __init__(self, max_tokens: int = 2000, max_turns: int = 20,
+                 summarizer: Optional[Callable[[str, int], str]] = None, summary_tokens: int = 300):
+        self.max_tokens = max_tokens
+        self.max_turns = max_turns
+        self.summarizer = summarizer
+        self.summary_tokens = summary_tokens
+        self.summary = ""
+        # (user, gemini, formatted, tokens) per turn, oldest first
+        self._turns = deque()
+        self._tokens = 0
+        self._prefix = None
+
+    def __len__(self) -> int:
+        return len(self._turns)
+
+    def __iter__(self):
+        for user, gemini, _, _ in self._turns:
+            yield {"user": user, "gemini": gemini}
+
+    @property
+    def tokens(self) -> int:
+        """Estimated tokens of the history part of the prompt."""
+        return self._tokens + (estimate_tokens(self.summary) if self.summary else 0)
+
+    def append(self, user_text: str, gemini_text: str) -> None:
+        formatted = format_turn(user_text, gemini_text)
+        self._turns.append((user_text, gemini_text, formatted, estimate_tokens(formatted)))
+        self._tokens += self._turns[-1][3]
+        if self._prefix is not None:
+            self._prefix += formatted
+        self._trim()
+
+    def _trim(self) -> None:
+        # oldest turns over the budget; the newest turn always stays, even
+        # if it is over budget on its own
+        excess = []
+        tokens, turns = self.tokens, len(self._turns)
+        for turn in self._turns:
+            if turns <= 1 or (turns <= self.max_turns and tokens <= self.max_tokens):
+                break
+            excess.append(turn)
+            tokens -= turn[3]
+            turns -= 1
+        if not excess:
+            return
+        if self.summarizer is not None:
+            earlier = f"Summary of the earlier conversation: {self.summary}\n" if self.summary else ""
+            try:
+                self.summary = self.summarizer(earlier + "".join(turn[2] for turn in excess), self.summary_tokens)
+            except Exception as e:
+                # keep the turns and try again on the next append, unless
+                # the history has grown to twice its budget meanwhile
+                print(f"Conversation summary failed: {e}")
+                if self.tokens <= 2 * self.max_tokens and len(self._turns) <= 2 * self.max_turns:
+                    return
+                if not self.summary.endswith(OMITTED_MARKER):
+                    self.summary = f"{self.summary} {OMITTED_MARKER}".strip()
+        for _ in excess:
+            self._tokens -= self._turns.popleft()[3]
+        self._prefix = None
 
-        return gemini_response
+    def prompt(self, user_text: str) -> str:
+        """The history followed by user_text, ready for generate_content."""
+        if self._prefix is None:
+            summary = f"Summary of the earlier conversation: {self.summary}\n" if self.summary else ""
+            self._prefix = summary + "".join(turn[2] for turn in self._turns)
+        return self._prefix + user_text
+
+    def clear(self) -> None:
+        self._turns.clear()
+        self._tokens = 0
+        self.summary = ""
+        self._prefix = None
+
+
+def gemini_summarizer(gemini_model: genai.GenerativeModel) -> Callable[[str, int], str]:
+    """Summarizer for ConversationHistory that asks gemini_model itself."""
+    def summarize(text: str, max_tokens: int) -> str:
+        # about three words per four tokens
+        prompt = (f"Summarize this conversation between a user and a health assistant in at most "
+                  f"{max_tokens * 3 // 4} words, keeping any health readings and questions that were "
+                  "mentioned:\n\n" + text)
+        return gemini_model.generate_content(prompt).text.strip()
+    return summarize
+
+
+# # Function to query Gemini API (Text)
+# Conversation history, bounded (see ConversationHistory)
+conversation_history = ConversationHistory()
+
+def query_gemini_api(user_text: str, gemini_model: genai.GenerativeModel,
+                     history: Union[ConversationHistory, List[dict]]) -> str:
+    """Queries the Gemini API, including conversation history.
+
+    Errors are raised, not returned as text, so they cannot end up in the
+    history as if Gemini had said them. Pass a gemini_client.GeminiClient as
+    gemini_model for rate limiting and retries.
+    """
+    if isinstance(history, ConversationHistory):
+        prompt = history.prompt(user_text)
+    else:
+        # plain list of {"user": ..., "gemini": ...} turns, unbounded
+        prompt = "".join(format_turn(turn['user'], turn['gemini']) for turn in history) + user_text
+
+    response = gemini_model.generate_content(prompt)
+    response.resolve()
+    gemini_response = response.text
+
+    # Update conversation history
+    if isinstance(history, ConversationHistory):
+        history.append(user_text, gemini_response)
+    else:
+        history.append({"user": user_text, "gemini": gemini_response})
 
-    except Exception as e:
-        return f"An error occurred: {e}"
\ No newline at end of file
+    return gemini_response
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+
+CACHE_PATH = "gemini_cache.db"
+
+# metric -> bucket width. Readings that land in the same buckets give the
+# same fingerprint, so asking again a few seconds later (when the heart rate
+# moved from 72.4 to 72.9) is answered from the cache.
+VALUE_BUCKETS = {
+    "Heart_Rate": 5.0,
+    "Body_Temperature": 0.25,
+    "Accel_X": 0.5,
+    "Accel_Y": 0.5,
+    "Accel_Z": 0.5,
+}
+DEFAULT_BUCKET = 0.5
+
+
+def bucket_value(metric, value):
+    """
+    Lower edge of the bucket value falls in, rounded for a stable repr.
+    """
+    if value is None:
+        return None
+    width = VALUE_BUCKETS.get(metric, DEFAULT_BUCKET)
+    return round((value // width) * width, 6)
+
+
+def normalize_text(text):
+    """
+    Lower case, single spaces, no trailing punctuation.
+    """
+    return re.sub(r"\s+", " ", text or "").strip().lower().rstrip(".!? ")
+
+
+def _normalize(obj, metric=None):
+    if isinstance(obj, dict):
+        return {str(k): _normalize(v, k if k in VALUE_BUCKETS else metric) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_normalize(v, metric) for v in obj]
+    if isinstance(obj, bool) or obj is None:
+        return obj
+    if isinstance(obj, (int, float)):
+        return bucket_value(metric, obj)
+    return normalize_text(str(obj))
+
+
+def fingerprint(kind, **fields):
+    """
+    Cache key for a request: `kind` names the prompt template, fields are its
+    inputs. Numbers under a metric name are bucketed and text is normalised
+    before hashing, so equivalent requests share a key.
+    """
+    canonical = json.dumps({"kind": kind, "fields": _normalize(fields)}, sort_keys=True)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class GeminiResponseCache(object):
+    """
+    Persistent Gemini response cache in SQLite.
+
+    Entries expire `ttl` seconds after they were stored; beyond max_entries
+    the least recently used ones are dropped.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=500, ttl=3600.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS responses
+                                  (key TEXT PRIMARY KEY, kind TEXT, response TEXT,
+                                   created REAL, last_used REAL)''')
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        The cached response for key, or None when missing or expired.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response, kind=None):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO responses (key, kind, response, created, last_used) "
+                               "VALUES (?, ?, ?, ?, ?)", (key, kind, response, now, now))
+            self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+            self._conn.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                               "ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
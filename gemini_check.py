@@ -0,0 +1,112 @@
+# Offline checks of GeminiClient and LLMExecutor against FakeGeminiModel:
+# no API key or network needed, takes a few seconds.
+#
+#   python gemini_check.py              # exit 1 if a check fails
+import sys
+import time
+
+from fake_gemini import FakeGeminiModel
+from gemini_client import CircuitBreaker, GeminiClient, RateLimitTimeout
+from llm_executor import LLMExecutor
+
+RESET = 0.05
+
+
+def open_client(model, **kwargs):
+    """
+    A client whose breaker was opened by one failed request and is ready
+    to let the next one through as the half open trial.
+    """
+    client = GeminiClient(model, rate=100.0, max_retries=0,
+                          breaker=CircuitBreaker(failure_threshold=1, reset_timeout=RESET), **kwargs)
+    model.error_code, model.outage_until = 503, time.time() + 60
+    try:
+        client.generate_content("fail")
+    except Exception:
+        pass
+    model.outage_until = None
+    assert client.breaker.state == "open", client.breaker.state
+    time.sleep(RESET)
+    return client
+
+
+def recovers(client):
+    """True if the next request is let through and closes the breaker."""
+    try:
+        client.generate_content("after")
+    except Exception as e:
+        print(f"  next request failed: {e!r}")
+        return False
+    return client.breaker.state == "closed"
+
+
+def check_abandoned_stream():
+    """
+    The trial is a stream the executor stops reading when it times out.
+    """
+    model = FakeGeminiModel(latency=1.0, chunk_words=1)
+    client = open_client(model)
+    executor = LLMExecutor(client, workers=1, timeout=0.2)
+    request = executor.submit("slow trial")
+    executor.close(wait=True)
+    if request.status != "timed_out":
+        print(f"  trial ended {request.status}, expected timed_out")
+        return False
+    model.latency = 0.0
+    return recovers(client)
+
+
+def check_rate_limit_timeout():
+    """
+    The trial gives up waiting for a rate limiter token.
+    """
+    client = open_client(FakeGeminiModel(), acquire_timeout=0.01)
+    client.bucket.rate, client.bucket.tokens = 0.001, 0.0
+    try:
+        client.generate_content("throttled trial")
+        print("  trial was not throttled")
+        return False
+    except RateLimitTimeout:
+        pass
+    client.bucket.tokens = 1.0
+    return recovers(client)
+
+
+def check_worker_freed():
+    """
+    A request that times out while the client retries or waits for a token
+    gives its worker back by its deadline, not after the retry budget.
+    """
+    ok = True
+    for name, model, bucket_tokens in (("retrying", FakeGeminiModel(fail_every=1, error_code=503), 5.0),
+                                       ("throttled", FakeGeminiModel(), 0.0)):
+        client = GeminiClient(model, rate=0.05, base_delay=5.0)
+        client.bucket.tokens = bucket_tokens
+        executor = LLMExecutor(client, workers=1, timeout=0.2)
+        start = time.monotonic()
+        request = executor.submit(name)
+        request.future.exception()
+        held = time.monotonic() - start
+        executor.close()
+        if held > 1.0:
+            print(f"  {name}: worker held for {held:.1f}s after a 0.2s timeout")
+            ok = False
+    return ok
+
+
+CHECKS = [check_abandoned_stream, check_rate_limit_timeout, check_worker_freed]
+
+
+def main():
+    failures = []
+    for check in CHECKS:
+        ok = check()
+        print(f"{'ok  ' if ok else 'FAIL'} {check.__name__}")
+        if not ok:
+            failures.append(check.__name__)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,402 @@
+import bisect
+import random
+import re
+import threading
+import time
+
+# HTTP status codes worth retrying: quota (429) and server side trouble.
+# google.api_core exceptions carry theirs in `code`, as do the fake model's.
+RETRYABLE_CODES = (429, 500, 502, 503, 504)
+
+
+class GeminiError(Exception):
+    pass
+
+
+class CircuitOpenError(GeminiError):
+    pass
+
+
+class RateLimitTimeout(GeminiError):
+    pass
+
+
+def status_code(exc):
+    code = getattr(exc, "code", None)
+    code = getattr(code, "value", code)  # grpc status codes are enums
+    if isinstance(code, tuple):
+        code = code[0]
+    return code
+
+
+def is_retryable(exc):
+    """
+    True for errors a later attempt may not hit: quota, unavailable and
+    timeouts.
+    """
+    return status_code(exc) in RETRYABLE_CODES or isinstance(exc, (TimeoutError, ConnectionError))
+
+
+def is_quota_error(exc):
+    """
+    True for 429: Gemini is up, we are over quota. That is for the rate
+    limiter and backoff to handle, not the circuit breaker.
+    """
+    return status_code(exc) == 429
+
+
+class TokenBucket(object):
+    """
+    `rate` requests per second on average, bursts of up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, timeout=None):
+        """
+        Take a token, waiting for one if needed. Returns the seconds waited;
+        raises RateLimitTimeout if none came within timeout.
+        """
+        start = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return now - start
+                wait = (1 - self.tokens) / self.rate
+            if timeout is not None and now + wait - start > timeout:
+                raise RateLimitTimeout(f"no request slot within {timeout}s")
+            time.sleep(wait)
+
+
+class CircuitBreaker(object):
+    """
+    Stops calls after `failure_threshold` failed requests in a row. After
+    reset_timeout seconds one trial call is let through ("half open"): if
+    it succeeds the breaker closes again, if not it stays open for another
+    reset_timeout.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened = None
+        self.opens = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        True if a call may go ahead, "trial" (also true) for the one call
+        let through half open. The trial must end in record_success,
+        record_failure or record_ignored, or the breaker stays half open.
+        """
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened >= self.reset_timeout:
+                self.state = "half_open"
+                return "trial"
+            return self.state == "closed"
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_ignored(self):
+        """
+        The call ended in a way that says nothing about an outage (e.g.
+        quota). A half open breaker goes back to open, ready to let the
+        next call through as the trial.
+        """
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+                self.opened = time.monotonic() - self.reset_timeout
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opens += 1
+                self.state = "open"
+                self.opened = time.monotonic()
+
+
+class LatencyHistogram(object):
+    """
+    Counts of latencies (seconds) per bucket, with bucket-resolution
+    percentiles.
+    """
+
+    BOUNDS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, bounds=BOUNDS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+
+    def percentile(self, q):
+        """
+        Upper bound of the bucket holding the q-th percentile (inf past
+        the last bound), None when empty.
+        """
+        with self._lock:
+            if not self.count:
+                return None
+            rank = q / 100.0 * self.count
+            seen = 0
+            for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+                seen += count
+                if seen >= rank:
+                    return bound
+
+    def snapshot(self):
+        labels = [f"<={bound}s" for bound in self.bounds] + [f">{self.bounds[-1]}s"]
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class GeminiClient(object):
+    """
+    Wraps a genai.GenerativeModel (or FakeGeminiModel) with the same
+    generate_content interface, adding:
+
+    - a token bucket, so all sessions together stay within `rate` requests
+      per second (the free tier allows 15 a minute)
+    - retries of quota/unavailable errors with jittered exponential backoff
+    - a circuit breaker, so an outage fails fast instead of queueing calls
+    - generate_batched(), which joins prompts arriving within batch_window
+      into one call
+    - metrics(): latency histogram, retries, failures and the hits of
+      `cache` (the GeminiResponseCache LLMExecutor checks first)
+
+    Errors are raised (GeminiError or the model's own exception), never
+    returned as text. A `deadline` (time.time()) bounds the waiting for
+    tokens and between retries, for callers that give up at some point.
+    """
+
+    def __init__(self, model, rate=0.25, burst=5, max_retries=4, base_delay=1.0, max_delay=30.0,
+                 breaker=None, cache=None, batch_window=0.5, max_batch=4, acquire_timeout=60.0):
+        self.model = model
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.cache = cache
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.acquire_timeout = acquire_timeout
+        self.latency = LatencyHistogram()
+
+        self._batch = None
+        self._batch_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+        self.throttled_seconds = 0.0
+        self.batches = 0
+        self.batched_prompts = 0
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def backoff(self, attempt):
+        """
+        Seconds to wait before retry `attempt` (1 based): full jitter over
+        an exponentially growing cap.
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def _failed(self, exc):
+        # only requests that finally fail count towards the breaker, and
+        # running out of quota is not an outage
+        self._count("failures")
+        if is_quota_error(exc):
+            self.breaker.record_ignored()
+        else:
+            self.breaker.record_failure()
+
+    def _call(self, prompt, stream, deadline=None):
+        self._count("requests")
+        # asked once per request: a half open breaker lets exactly one
+        # request through, retries included
+        allowed = self.breaker.allow()
+        if not allowed:
+            self._count("rejected")
+            raise CircuitOpenError("Gemini is failing, not sending requests for now")
+        trial = allowed == "trial"
+        # whether the breaker has heard how this request went; a trial that
+        # ends without a verdict (RateLimitTimeout, an abandoned stream)
+        # passes the trial on to the next request instead of leaving the
+        # breaker half open for good
+        settled = False
+        attempt = 0
+        try:
+            while True:
+                timeout = self.acquire_timeout
+                if deadline is not None:
+                    timeout = min(timeout, deadline - time.time())
+                    if timeout <= 0:
+                        raise TimeoutError("deadline passed before Gemini answered")
+                self._count("throttled_seconds", self.bucket.acquire(timeout))
+                self._count("calls")
+                start = time.monotonic()
+                try:
+                    response = self.model.generate_content(prompt, stream=stream)
+                    if not stream:
+                        response.resolve()
+                        # .text raises for a blocked or empty answer; that
+                        # counts as this attempt failing
+                        response.text
+                except Exception as e:
+                    delay = self.backoff(attempt + 1)
+                    # no retry the caller would not wait for
+                    if (attempt < self.max_retries and is_retryable(e) and
+                            (deadline is None or time.time() + delay < deadline)):
+                        attempt += 1
+                        self._count("retries")
+                        time.sleep(delay)
+                        continue
+                    settled = True
+                    self._failed(e)
+                    raise
+                settled = True
+                if not stream:
+                    self.breaker.record_success()
+                    self.latency.observe(time.monotonic() - start)
+                    return response
+                return self._stream(response, start, trial)
+        finally:
+            if trial and not settled:
+                self.breaker.record_ignored()
+
+    def _stream(self, response, start, trial):
+        # a failure half way through a stream cannot be retried without
+        # repeating text the caller already has, so it is only recorded
+        settled = False
+        try:
+            for chunk in response:
+                yield chunk
+            settled = True
+            self.breaker.record_success()
+            self.latency.observe(time.monotonic() - start)
+        except Exception as e:
+            settled = True
+            self._failed(e)
+            raise
+        finally:
+            # closed early (GeneratorExit) by a caller that gave up
+            if trial and not settled:
+                self.breaker.record_ignored()
+
+    def generate_content(self, prompt, stream=False, deadline=None):
+        return self._call(prompt, stream, deadline)
+
+    def generate_batch(self, prompts, deadline=None):
+        """
+        Texts for several prompts from one call. If the answer does not
+        split into one part per prompt, each prompt is sent on its own.
+        """
+        if len(prompts) == 1:
+            return [self._call(prompts[0], False, deadline).text]
+        combined = ("Answer each of the following independent requests. Start the answer to request N "
+                    "with a line '### Answer N' and write nothing before the first answer.\n\n" +
+                    "\n\n".join(f"### Request {k}\n{prompt.strip()}" for k, prompt in enumerate(prompts, 1)))
+        text = self._call(combined, False, deadline).text
+        parts = re.split(r"^### Answer (\d+)\s*$", text, flags=re.MULTILINE)
+        answers = {int(number): answer.strip() for number, answer in zip(parts[1::2], parts[2::2])}
+        if sorted(answers) == list(range(1, len(prompts) + 1)):
+            return [answers[k] for k in range(1, len(prompts) + 1)]
+        return [self._call(prompt, False, deadline).text for prompt in prompts]
+
+    def generate_batched(self, prompt, deadline=None):
+        """
+        Like generate_content(prompt).text, but prompts from other threads
+        arriving within batch_window share the call. The first caller of a
+        batch waits out the window and sends it for everyone, until the
+        latest deadline of the batch.
+        """
+        with self._batch_lock:
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = {"prompts": [], "deadlines": [], "results": None, "error": None,
+                                       "full": threading.Event(), "done": threading.Event()}
+            index = len(batch["prompts"])
+            batch["prompts"].append(prompt)
+            batch["deadlines"].append(deadline)
+            if len(batch["prompts"]) >= self.max_batch:
+                # no room for more: the next prompt starts a new batch and
+                # this one goes out now
+                self._batch = None
+                batch["full"].set()
+        if not leader:
+            batch["done"].wait()
+        else:
+            batch["full"].wait(self.batch_window)
+            with self._batch_lock:
+                if self._batch is batch:
+                    self._batch = None
+            prompts, deadlines = batch["prompts"], batch["deadlines"]
+            try:
+                batch["results"] = self.generate_batch(prompts, None if None in deadlines else max(deadlines))
+                self._count("batches")
+                self._count("batched_prompts", len(prompts))
+            except Exception as e:
+                batch["error"] = e
+            batch["done"].set()
+        if batch["error"] is not None:
+            raise batch["error"]
+        return batch["results"][index]
+
+    def metrics(self):
+        with self._stats_lock:
+            stats = {
+                "requests": self.requests,
+                "calls": self.calls,
+                "retries": self.retries,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "throttled_seconds": round(self.throttled_seconds, 3),
+                "batches": self.batches,
+                "batched_prompts": self.batched_prompts,
+            }
+        stats["circuit"] = self.breaker.state
+        stats["circuit_opens"] = self.breaker.opens
+        if self.cache is not None:
+            stats["cache_hits"] = self.cache.hits
+            stats["cache_misses"] = self.cache.misses
+        stats["latency"] = self.latency.snapshot()
+        return stats
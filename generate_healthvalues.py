@@ -1,13 +1,29 @@
 import paho.mqtt.client as mqtt
+import os
 import time
-import json
-import sqlite3
 from datetime import datetime
 from mpu6050 import mpu6050
 from heartrate_monitor import HeartRateMonitor
 import board
 import adafruit_pct2075
 import random
+from health_db import DB_PATH, HealthDataWriter, connect, init_db
+from insight_detector import InsightDetector
+from health_payload import encode, encode_frame, topic_for
+
+# "binary" (30-byte readings on health_sensor/data/v1) or "json" (the
+# original format on health_sensor/data) for subscribers that need it
+PAYLOAD_FORMAT = os.getenv("HEALTH_PAYLOAD_FORMAT", "binary")
+
+# Batching: read the accelerometer SAMPLE_RATE times a second and publish
+# everything collected every PUBLISH_INTERVAL seconds as one frame (binary
+# frames go to health_sensor/data/v2). Heart rate and temperature change
+# slowly and are still read once a second. The defaults publish a single
+# reading every second, as before.
+SAMPLE_RATE = float(os.getenv("HEALTH_SAMPLE_RATE", "1"))
+PUBLISH_INTERVAL = float(os.getenv("HEALTH_PUBLISH_INTERVAL", "1"))
+# more than one sample per message: publish frames instead of readings
+BATCHING = SAMPLE_RATE * PUBLISH_INTERVAL > 1
 
 # # Initialize sensors
 try:
@@ -34,20 +50,9 @@ except Exception as e:
     print(f"Failed to initialize PCT2075: {e}")
     exit()
 
-# SQLite setup for storing resting and current values
-def init_db():
-    conn = sqlite3.connect("health_data.db")
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS resting_values 
-                 (metric TEXT PRIMARY KEY, value REAL)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS current_values 
-                 (timestamp TEXT, metric TEXT, value REAL, context TEXT)''')
-    conn.commit()
-    conn.close()
-
 # Store initial resting values (taken as an average over 10 seconds at rest)
 def store_resting_values():
-    conn = sqlite3.connect("health_data.db")
+    conn = connect(DB_PATH)
     c = conn.cursor()
     
     # Collect resting values over 10 seconds
@@ -105,17 +110,27 @@ def collect_sensor_data(context="resting"):
         "context": context
     }
 
-def store_current_values(data):
-    conn = sqlite3.connect("health_data.db")
-    c = conn.cursor()
-    timestamp = data["timestamp"]
-    context = data["context"]
-    for metric, value in data.items():
-        if metric not in ["timestamp", "context"]:
-            c.execute("INSERT INTO current_values (timestamp, metric, value, context) VALUES (?, ?, ?, ?)", 
-                      (timestamp, metric, value, context))
-    conn.commit()
-    conn.close()
+def collect_slow_values():
+    # Heart rate and temperature for the once-a-second frame entries
+    return {
+        "Heart_Rate": hr_sensor.bpm if hr_sensor.bpm > 0 else 70.0,  # Fallback if no valid reading
+        "Body_Temperature": temp_sensor.temperature,
+    }
+
+def collect_accel_sample(context, slow_values=None):
+    # One frame entry: always the accelerometer, plus heart rate and
+    # temperature when slow_values carries a fresh reading of them
+    accel_data = accel_sensor.get_accel_data()
+    sample = {
+        "Accel_X": accel_data["x"],
+        "Accel_Y": accel_data["y"],
+        "Accel_Z": accel_data["z"],
+        "timestamp": datetime.now().isoformat(),
+        "context": context
+    }
+    if slow_values:
+        sample.update(slow_values)
+    return sample
 
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
@@ -127,6 +142,10 @@ def on_connect(client, userdata, flags, rc):
 init_db()
 store_resting_values()
 
+# One connection for the whole run; readings are buffered and written in
+# batches instead of a transaction per second
+writer = HealthDataWriter(batch_size=50, flush_interval=5.0, detector=InsightDetector())
+
 # Create publisher client
 publisher = mqtt.Client()
 publisher.on_connect = on_connect
@@ -137,22 +156,50 @@ try:
     contexts = ["resting", "running", "walking", "exercising"]
     current_context_index = 0
     
-    while True:
-        if random.randint(1, 5) == 1:
-            current_context_index = (current_context_index + 1) % len(contexts)
+    if not BATCHING:
+        while True:
+            if random.randint(1, 5) == 1:
+                current_context_index = (current_context_index + 1) % len(contexts)
         
-        context = contexts[current_context_index]
-        sensor_data = collect_sensor_data(context)
-        store_current_values(sensor_data)
+            context = contexts[current_context_index]
+            sensor_data = collect_sensor_data(context)
+            writer.write(sensor_data)
         
-        topic = "health_sensor/data"
-        publisher.publish(topic, json.dumps(sensor_data), qos=1)
-        print(f"Published to {topic} (Context: {context}): {sensor_data}")
-        time.sleep(1)
+            topic = topic_for("health_sensor/data", PAYLOAD_FORMAT)
+            publisher.publish(topic, encode(sensor_data, PAYLOAD_FORMAT), qos=1)
+            print(f"Published to {topic} (Context: {context}): {sensor_data}")
+            time.sleep(1)
+    else:
+        # one message per PUBLISH_INTERVAL whatever the sample rate
+        topic = topic_for("health_sensor/data", PAYLOAD_FORMAT, frame=True)
+        frame = []
+        next_sample = next_second = time.monotonic()
+        next_publish = next_sample + PUBLISH_INTERVAL
+        while True:
+            slow_values = None
+            if time.monotonic() >= next_second:
+                if random.randint(1, 5) == 1:
+                    current_context_index = (current_context_index + 1) % len(contexts)
+                slow_values = collect_slow_values()
+                next_second += 1.0
+
+            context = contexts[current_context_index]
+            frame.append(collect_accel_sample(context, slow_values))
+
+            if time.monotonic() >= next_publish:
+                writer.write_many(frame)
+                publisher.publish(topic, encode_frame(frame, PAYLOAD_FORMAT), qos=1)
+                print(f"Published {len(frame)} samples to {topic} (Context: {context})")
+                frame = []
+                next_publish += PUBLISH_INTERVAL
+
+            next_sample += 1.0 / SAMPLE_RATE
+            time.sleep(max(0.0, next_sample - time.monotonic()))
 
 except KeyboardInterrupt:
     print("Stopping publisher... User can now request insights.")
     hr_sensor.stop_sensor()
+    writer.close()
     publisher.loop_stop()
     publisher.disconnect()
 
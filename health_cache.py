@@ -0,0 +1,172 @@
+import threading
+import time
+from collections import deque
+
+from health_db import (DB_PATH, EVENT_COLUMNS, METRIC_COLUMNS, MAX_POINTS, SAMPLE_COLUMNS, choose_resolution,
+                       connect, init_db, pick_resolution, query_historical_data, row_from_reading, rows_to_frame)
+from insight_detector import InsightEvent
+
+
+class HealthDataCache(object):
+    """
+    Recent readings per metric, shared by every dashboard session.
+
+    Each metric keeps a ring buffer of its last `capacity` samples. Readings
+    arrive from the MQTT handler through add(); refresh() picks up anything
+    written to SQLite by someone else, asking only for rows newer than the
+    high-water mark. Ranges older than the buffers are answered from
+    SQLite (usually from the rollups) on one long-lived connection. Insight
+    events are read the same way, by id above the last one seen.
+    """
+
+    def __init__(self, path=DB_PATH, capacity=3600, refresh_interval=1.0, static_ttl=60.0, max_events=100):
+        self.path = path
+        self.capacity = capacity
+        self.refresh_interval = refresh_interval
+        self.static_ttl = static_ttl
+
+        init_db(path)
+        self._conn = connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        # metric -> deque of (ts, value, context, value, value), the row
+        # shape rows_to_frame and the rollup queries use
+        self._buffers = {metric: deque(maxlen=capacity) for metric in METRIC_COLUMNS}
+        self._latest = None
+        self.high_water = None
+        self._events = deque(maxlen=max_events)
+        self.last_event_id = 0
+        self.last_refresh = 0.0
+
+        self._resting = None
+        self._metrics = None
+        self._static_loaded = 0.0
+
+        self.hits = 0
+        self.misses = 0
+        self.refresh(force=True)
+
+    def add(self, data):
+        """
+        Add one sensor reading dict.
+        """
+        self.add_rows([row_from_reading(data)])
+
+    def add_rows(self, rows):
+        """
+        Add samples rows in time order; rows at or below the high-water mark
+        are already cached and skipped.
+        """
+        with self._lock:
+            for row in rows:
+                ts, context = row[0], row[1]
+                if self.high_water is not None and ts <= self.high_water:
+                    continue
+                for metric, value in zip(METRIC_COLUMNS, row[2:]):
+                    if value is not None:
+                        self._buffers[metric].append((ts, value, context, value, value))
+                self._latest = row
+                self.high_water = ts
+
+    def refresh(self, force=False):
+        """
+        Load rows newer than the high-water mark from SQLite, at most once
+        per refresh_interval.
+        """
+        now = time.time()
+        if not force and now - self.last_refresh < self.refresh_interval:
+            return 0
+        self.last_refresh = now
+        with self._lock:
+            # newest `capacity` rows above the mark, oldest first
+            rows = self._conn.execute(
+                f"SELECT * FROM (SELECT {', '.join(SAMPLE_COLUMNS)} FROM samples WHERE ts > ? "
+                "ORDER BY ts DESC LIMIT ?) ORDER BY ts",
+                (-1 if self.high_water is None else self.high_water, self.capacity)).fetchall()
+            events = self._conn.execute(
+                f"SELECT id, {EVENT_COLUMNS} FROM insight_events WHERE id > ? ORDER BY id",
+                (self.last_event_id,)).fetchall()
+            for event in events[-self._events.maxlen:]:
+                self._events.append(InsightEvent.from_row(event[1:]))
+            if events:
+                self.last_event_id = events[-1][0]
+        self.add_rows(rows)
+        return len(rows)
+
+    def _load_static(self):
+        if self._resting is not None and time.time() - self._static_loaded < self.static_ttl:
+            return
+        with self._lock:
+            self._resting = dict(self._conn.execute("SELECT metric, value FROM resting_values").fetchall())
+            self._metrics = [row[0] for row in self._conn.execute("SELECT DISTINCT metric FROM resting_values")]
+        self._static_loaded = time.time()
+
+    def resting_values(self):
+        self._load_static()
+        return dict(self._resting)
+
+    def available_metrics(self):
+        self._load_static()
+        return list(self._metrics)
+
+    def latest_timestamp(self):
+        self.refresh()
+        return self.high_water
+
+    def latest(self):
+        """
+        {metric: (value, context)} with the newest value of every metric (a
+        batched frame carries heart rate and temperature on only some rows)
+        and the newest context.
+        """
+        self.refresh()
+        with self._lock:
+            if self._latest is None:
+                return {}
+            context = self._latest[1]
+            return {metric: (buffer[-1][1], context) for metric, buffer in self._buffers.items() if buffer}
+
+    def recent_events(self, within=300.0):
+        """
+        InsightEvents from the `within` seconds up to the newest reading,
+        newest first.
+        """
+        self.refresh()
+        with self._lock:
+            if self.high_water is None:
+                return []
+            since = self.high_water - int(within * 1000)
+            return sorted((event for event in self._events if event.ts >= since), key=lambda e: -e.ts)
+
+    def resolution_for(self, metric, time_range_hours, end=None, max_points=MAX_POINTS):
+        """
+        The resolution history() would read for this range, see
+        health_db.choose_resolution.
+        """
+        end = int(time.time() * 1000) if end is None else end
+        start = end - int(time_range_hours * 3600 * 1000)
+        with self._lock:
+            return choose_resolution(self._conn, metric, start, end, max_points)
+
+    def history(self, metric, time_range_hours, end=None, max_points=MAX_POINTS, resolution=None):
+        """
+        The time_range_hours before end (epoch ms, default now), see
+        health_db.query_historical_data. Raw ranges inside the ring buffer
+        are served from memory; the rest goes to SQLite.
+        """
+        self.refresh()
+        end = int(time.time() * 1000) if end is None else end
+        start = end - int(time_range_hours * 3600 * 1000)
+        raw = resolution == 0 or (resolution is None and pick_resolution((end - start) / 1000.0, max_points) == 0)
+        with self._lock:
+            buffer = self._buffers[metric]
+            if raw and buffer and buffer[0][0] <= start:
+                rows = [row for row in buffer if start <= row[0] <= end]
+                self.hits += 1
+                return rows_to_frame(rows)
+            self.misses += 1
+            rows = query_historical_data(self._conn, metric, start, end, max_points, resolution)
+        return rows_to_frame(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
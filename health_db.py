@@ -0,0 +1,407 @@
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+# SQLite storage shared by the publisher (generate_healthvalues.py) and the
+# dashboard (gain_healthinsightswithllm.py)
+DB_PATH = "health_data.db"
+
+# durability -> PRAGMA synchronous. In WAL mode "normal" only fsyncs at
+# checkpoints: a power cut can lose the last few flushes but never corrupts
+# the database. "full" fsyncs every flush, "off" leaves it to the OS.
+DURABILITY = {"off": "OFF", "normal": "NORMAL", "full": "FULL"}
+
+# metric name used by the sensors and the dashboard -> samples column
+METRIC_COLUMNS = {
+    "Heart_Rate": "heart_rate",
+    "Body_Temperature": "body_temperature",
+    "Accel_X": "accel_x",
+    "Accel_Y": "accel_y",
+    "Accel_Z": "accel_z",
+}
+
+# PRAGMA user_version of the current layout
+#   0: current_values, one row per metric with an ISO text timestamp
+#   1: samples, one row per reading keyed by epoch milliseconds
+#   2: rollups, min/max/sum/count per metric and context at ROLLUP_RESOLUTIONS
+#   3: insight_events, raised by insight_detector on the ingest path
+SCHEMA_VERSION = 3
+
+# rollup bucket widths in seconds. The first level is built from samples,
+# every other level from the one before it.
+ROLLUP_RESOLUTIONS = (10, 60, 3600)
+
+# how long to keep each resolution in seconds (0 = raw samples, None = forever)
+RETENTION = {0: 7 * 86400, 10: 30 * 86400, 60: 365 * 86400, 3600: None}
+
+# choose_resolution picks the finest resolution that returns at most
+# this many rows per context
+MAX_POINTS = 1500
+
+SAMPLE_COLUMNS = ["ts", "context"] + list(METRIC_COLUMNS.values())
+INSERT_SAMPLE = "INSERT OR IGNORE INTO samples ({0}) VALUES ({1})".format(
+    ", ".join(SAMPLE_COLUMNS), ", ".join("?" * len(SAMPLE_COLUMNS)))
+
+INSERT_EVENT = '''INSERT OR IGNORE INTO insight_events (ts, metric, kind, value, baseline, score, context)
+    VALUES (?, ?, ?, ?, ?, ?, ?)'''
+EVENT_COLUMNS = "ts, metric, kind, value, baseline, score, context"
+
+# a bucket is rebuilt from scratch every time, which keeps updates idempotent
+ROLLUP_FROM_SAMPLES = '''INSERT OR REPLACE INTO rollups (resolution, metric, bucket, context, min, max, sum, count)
+    SELECT ?, ?, ts - ts % ?, context, MIN({0}), MAX({0}), SUM({0}), COUNT({0})
+    FROM samples WHERE ts >= ? AND ts < ? AND {0} IS NOT NULL
+    GROUP BY ts - ts % ?, context'''
+ROLLUP_FROM_ROLLUPS = '''INSERT OR REPLACE INTO rollups (resolution, metric, bucket, context, min, max, sum, count)
+    SELECT ?, metric, bucket - bucket % ?, context, MIN(min), MAX(max), SUM(sum), SUM(count)
+    FROM rollups WHERE resolution = ? AND metric = ? AND bucket >= ? AND bucket < ?
+    GROUP BY bucket - bucket % ?, context'''
+
+
+def to_epoch_ms(timestamp):
+    """
+    Epoch milliseconds from an ISO timestamp (naive = local time, as written
+    by datetime.now().isoformat()) or from a number that already is one.
+    """
+    if isinstance(timestamp, (int, float)):
+        return int(timestamp)
+    return int(round(datetime.fromisoformat(timestamp).timestamp() * 1000))
+
+
+def from_epoch_ms(ts):
+    """
+    Local ISO timestamp for epoch milliseconds.
+    """
+    return datetime.fromtimestamp(ts / 1000.0).isoformat()
+
+
+def metric_column(metric):
+    try:
+        return METRIC_COLUMNS[metric]
+    except KeyError:
+        raise ValueError(f"unknown metric {metric!r}")
+
+
+def connect(path=DB_PATH, check_same_thread=True):
+    """
+    Open a connection in WAL mode, so readers never block the writer.
+    """
+    conn = sqlite3.connect(path, timeout=10.0, check_same_thread=check_same_thread)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def init_db(path=DB_PATH):
+    """
+    Create the tables and bring an older database up to SCHEMA_VERSION.
+    """
+    conn = connect(path)
+    conn.isolation_level = None
+    try:
+        # IMMEDIATE so the publisher and the dashboard starting together
+        # cannot both run the migration
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute('''CREATE TABLE IF NOT EXISTS resting_values
+                        (metric TEXT PRIMARY KEY, value REAL)''')
+        # ts is the rowid: latest-sample and time-range queries are b-tree
+        # lookups, and readings stored twice (publisher and dashboard on the
+        # same database) collapse into one row
+        conn.execute('''CREATE TABLE IF NOT EXISTS samples
+                        (ts INTEGER PRIMARY KEY, context TEXT, {0})'''.format(
+            ", ".join(f"{column} REAL" for column in METRIC_COLUMNS.values())))
+        # one row per metric, context and bucket; WITHOUT ROWID keeps the
+        # rows in primary key order, so a chart is a single range scan
+        conn.execute('''CREATE TABLE IF NOT EXISTS rollups
+                        (resolution INTEGER, metric TEXT, bucket INTEGER, context TEXT,
+                         min REAL, max REAL, sum REAL, count INTEGER,
+                         PRIMARY KEY (resolution, metric, bucket, context)) WITHOUT ROWID''')
+        # id is the order events were stored in, so readers can ask for
+        # "everything after the last id I saw"; the unique index drops the
+        # copy raised by a second writer on the same readings
+        conn.execute('''CREATE TABLE IF NOT EXISTS insight_events
+                        (id INTEGER PRIMARY KEY, ts INTEGER, metric TEXT, kind TEXT,
+                         value REAL, baseline REAL, score REAL, context TEXT)''')
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS insight_events_key ON insight_events (ts, metric, kind)")
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            _migrate_current_values(conn)
+        if version < 2:
+            first, last = conn.execute("SELECT MIN(ts), MAX(ts) FROM samples").fetchone()
+            if first is not None:
+                update_rollups(conn, first, last)
+        conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def _migrate_current_values(conn):
+    """
+    Copy the per-metric current_values rows into samples, one row per
+    timestamp, and keep the old table as current_values_legacy.
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'current_values'").fetchone()
+    if not exists:
+        return
+    conn.create_function("to_epoch_ms", 1, to_epoch_ms, deterministic=True)
+    pivot = ", ".join(f"MAX(CASE WHEN metric = '{metric}' THEN value END)" for metric in METRIC_COLUMNS)
+    conn.execute(f'''INSERT OR IGNORE INTO samples ({", ".join(SAMPLE_COLUMNS)})
+                     SELECT to_epoch_ms(timestamp), MAX(context), {pivot}
+                     FROM current_values GROUP BY timestamp''')
+    conn.execute("ALTER TABLE current_values RENAME TO current_values_legacy")
+    print("Migrated current_values to samples (old rows kept in current_values_legacy)")
+
+
+def update_rollups(conn, start, end):
+    """
+    Rebuild every rollup bucket that contains a sample between start and end
+    (epoch ms, inclusive). Run it in the transaction that inserted them.
+    """
+    previous = None
+    for resolution in ROLLUP_RESOLUTIONS:
+        width = resolution * 1000
+        lo = start - start % width
+        hi = end - end % width + width
+        for metric, column in METRIC_COLUMNS.items():
+            if previous is None:
+                conn.execute(ROLLUP_FROM_SAMPLES.format(column), (resolution, metric, width, lo, hi, width))
+            else:
+                conn.execute(ROLLUP_FROM_ROLLUPS, (resolution, width, previous, metric, lo, hi, width))
+        previous = resolution
+
+
+def apply_retention(conn, retention=RETENTION, now=None):
+    """
+    Delete samples and rollups older than their retention period.
+    """
+    now = int(time.time() * 1000) if now is None else now
+    for resolution, seconds in retention.items():
+        if seconds is None:
+            continue
+        cutoff = now - seconds * 1000
+        if resolution == 0:
+            conn.execute("DELETE FROM samples WHERE ts < ?", (cutoff,))
+        else:
+            conn.execute("DELETE FROM rollups WHERE resolution = ? AND bucket < ?", (resolution, cutoff))
+
+
+def pick_resolution(span_seconds, max_points=MAX_POINTS):
+    """
+    0 for raw samples (about one per second) or the finest rollup resolution
+    that covers span_seconds in at most max_points buckets.
+    """
+    if span_seconds <= max_points:
+        return 0
+    for resolution in ROLLUP_RESOLUTIONS:
+        if span_seconds / resolution <= max_points:
+            return resolution
+    return ROLLUP_RESOLUTIONS[-1]
+
+
+def row_from_reading(data):
+    """
+    Turn one sensor reading dict (metrics plus "timestamp" and "context") into
+    a samples row. Missing metrics are stored as NULL.
+    """
+    return (to_epoch_ms(data["timestamp"]), data["context"]) + \
+        tuple(data.get(metric) for metric in METRIC_COLUMNS)
+
+
+# Queries behind health_cache. Frames carry timestamps as local ISO strings.
+def rows_to_frame(rows):
+    return pd.DataFrame([(from_epoch_ms(ts), value, context, low, high) for ts, value, context, low, high in rows],
+                        columns=["Timestamp", "Value", "Context", "Min", "Max"])
+
+
+def choose_resolution(conn, metric, start, end, max_points=MAX_POINTS):
+    """
+    The resolution query_historical_data reads for this range: 0 for raw
+    samples, a ROLLUP_RESOLUTIONS entry, or None when metric has no data.
+    """
+    first = conn.execute("SELECT MIN(bucket) FROM rollups WHERE resolution = ? AND metric = ?",
+                         (ROLLUP_RESOLUTIONS[0], metric)).fetchone()[0]
+    if first is None:
+        return None
+    # size the resolution by the part of the range that has data
+    start = max(start, first)
+    resolution = pick_resolution((end - start) / 1000.0, max_points)
+    if resolution == 0:
+        raw_first = conn.execute("SELECT MIN(ts) FROM samples").fetchone()[0]
+        if raw_first is None or raw_first - raw_first % (ROLLUP_RESOLUTIONS[0] * 1000) > start:
+            # the older samples were dropped by retention
+            resolution = ROLLUP_RESOLUTIONS[0]
+    return resolution
+
+
+def query_historical_data(conn, metric, start, end, max_points=MAX_POINTS, resolution=None):
+    """
+    (ts, value, context, min, max) rows between start and end (epoch ms).
+    Short ranges are raw samples; longer ones come from the rollups, with ts
+    the bucket start, value the bucket mean and min/max its extremes. Pass
+    resolution to skip choose_resolution.
+    """
+    column = metric_column(metric)
+    if resolution is None:
+        resolution = choose_resolution(conn, metric, start, end, max_points)
+        if resolution is None:
+            return []
+    if resolution == 0:
+        return conn.execute(f"SELECT ts, {column}, context, {column}, {column} FROM samples "
+                            f"WHERE ts >= ? AND ts <= ? AND {column} IS NOT NULL ORDER BY ts",
+                            (start, end)).fetchall()
+    width = resolution * 1000
+    return conn.execute("SELECT bucket, sum / count, context, min, max FROM rollups "
+                        "WHERE resolution = ? AND metric = ? AND bucket >= ? AND bucket <= ? ORDER BY bucket",
+                        (resolution, metric, start - start % width, end)).fetchall()
+
+
+class HealthDataWriter(object):
+    """
+    Long-lived samples writer.
+
+    Readings are buffered in memory and written by a background thread in
+    one executemany transaction whenever batch_size rows are pending or
+    flush_interval seconds have passed, whichever comes first. The same
+    transaction updates the rollups and stores the events raised by
+    `detector` (an insight_detector.InsightDetector) for the queued rows.
+    Retention runs every RETENTION_INTERVAL seconds (retention=None keeps
+    everything).
+    """
+
+    RETENTION_INTERVAL = 600.0
+
+    def __init__(self, path=DB_PATH, batch_size=100, flush_interval=1.0, durability="normal",
+                 retention=RETENTION, detector=None):
+        if durability not in DURABILITY:
+            raise ValueError(f"durability must be one of {sorted(DURABILITY)}, not {durability!r}")
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self.retention = retention
+        self.detector = detector
+
+        init_db(path)
+        self._conn = connect(path, check_same_thread=False)
+        self._conn.execute(f"PRAGMA synchronous={DURABILITY[durability]}")
+
+        self._pending = []
+        self._pending_events = []
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+
+        self.rows_written = 0
+        self.events_written = 0
+        self.flushes = 0
+        self.last_flush = time.time()
+        self.last_retention = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="HealthDataWriter")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, data):
+        """
+        Queue one sensor reading dict.
+        """
+        self.write_rows([row_from_reading(data)])
+
+    def write_many(self, readings):
+        """
+        Queue a list of sensor reading dicts, e.g. one MQTT frame.
+        """
+        self.write_rows([row_from_reading(data) for data in readings])
+
+    def write_rows(self, rows):
+        """
+        Queue samples rows: (ts in epoch ms, context, heart_rate,
+        body_temperature, accel_x, accel_y, accel_z).
+        """
+        if self._closed:
+            raise RuntimeError("HealthDataWriter is closed")
+        with self._lock:
+            events = self.detector.process_rows(rows) if self.detector is not None else []
+            self._pending.extend(rows)
+            self._pending_events.extend(event.as_row() for event in events)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """
+        Write everything queued so far in a single transaction. If it fails
+        the rows stay queued and the error is raised.
+        """
+        with self._lock:
+            rows, self._pending = self._pending, []
+            events, self._pending_events = self._pending_events, []
+        if not rows:
+            return 0
+        try:
+            with self._db_lock:
+                with self._conn:
+                    self._conn.executemany(INSERT_SAMPLE, rows)
+                    update_rollups(self._conn, min(row[0] for row in rows), max(row[0] for row in rows))
+                    if events:
+                        self._conn.executemany(INSERT_EVENT, events)
+        except Exception:
+            # the transaction was rolled back: queue the batch again, ahead
+            # of anything written since, so the next flush retries it
+            with self._lock:
+                self._pending[:0] = rows
+                self._pending_events[:0] = events
+            raise
+        self.rows_written += len(rows)
+        self.events_written += len(events)
+        self.flushes += 1
+        self.last_flush = time.time()
+        return len(rows)
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                if self.retention and time.time() - self.last_retention >= self.RETENTION_INTERVAL:
+                    self.enforce_retention()
+            except Exception as e:
+                # e.g. SQLITE_BUSY while another process holds the database;
+                # the rows stay queued for the next tick
+                print(f"HealthDataWriter flush failed: {e}")
+
+    def enforce_retention(self):
+        with self._db_lock:
+            with self._conn:
+                apply_retention(self._conn, self.retention)
+        self.last_retention = time.time()
+
+    def close(self):
+        """
+        Stop the flush thread, write what is left and close the connection.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+        self.flush()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,142 @@
+import json
+import math
+import struct
+
+from health_db import METRIC_COLUMNS, to_epoch_ms
+
+# Wire formats for health_sensor/data readings.
+#
+# JSON (the original format) goes to the base topic. Binary payloads go to
+# the base topic plus "/v<version>", so a subscriber picks the formats it
+# understands by topic; a subscriber on "<base>/#" gets all of them and
+# tells them apart by the first byte: "{" for JSON, else the version.
+#
+# Binary v1, one reading, little endian, 30 bytes:
+#   B  version (1)
+#   B  context, index into CONTEXTS (255 = unknown)
+#   q  timestamp, epoch milliseconds
+#   5f Heart_Rate, Body_Temperature, Accel_X, Accel_Y, Accel_Z (NaN = missing)
+#
+# Binary v2, a frame of readings, 11 + 25 bytes per reading:
+#   B  version (2)
+#   q  base timestamp, epoch milliseconds (the earliest reading)
+#   H  number of readings
+# then per reading:
+#   B  context
+#   I  milliseconds after the base timestamp
+#   5f metrics as in v1
+#
+# A JSON frame is {"samples": [reading, ...]}.
+#
+# Binary metrics are float32 (about 7 significant digits), so 0.1 would
+# come back as 0.10000000149011612; decoded values are rounded to
+# DECIMALS places, well above what the sensors resolve.
+VERSION = 1
+FRAME_VERSION = 2
+CONTEXTS = ("resting", "running", "walking", "exercising")
+UNKNOWN_CONTEXT = 255
+UNKNOWN_CONTEXT_NAME = "unknown"
+FORMATS = ("json", "binary")
+DECIMALS = 4
+
+READING = struct.Struct("<BBq" + "f" * len(METRIC_COLUMNS))
+FRAME_HEADER = struct.Struct("<BqH")
+FRAME_READING = struct.Struct("<BI" + "f" * len(METRIC_COLUMNS))
+MAX_FRAME_READINGS = 0xFFFF
+
+_CONTEXT_CODES = {name: code for code, name in enumerate(CONTEXTS)}
+_JSON_FIRST_BYTE = ord("{")
+
+
+class PayloadError(ValueError):
+    pass
+
+
+def topic_for(base, fmt="binary", frame=False):
+    """
+    Topic a reading (or a frame of them) in format `fmt` is published on.
+    """
+    if fmt == "json":
+        return base
+    if fmt == "binary":
+        return f"{base}/v{FRAME_VERSION if frame else VERSION}"
+    raise ValueError(f"format must be one of {FORMATS}, not {fmt!r}")
+
+
+def _metric_values(data):
+    return [math.nan if data.get(metric) is None else data[metric] for metric in METRIC_COLUMNS]
+
+
+def _reading(context, ts, values):
+    data = {metric: round(value, DECIMALS) for metric, value in zip(METRIC_COLUMNS, values) if not math.isnan(value)}
+    data["timestamp"] = ts
+    data["context"] = CONTEXTS[context] if context < len(CONTEXTS) else UNKNOWN_CONTEXT_NAME
+    return data
+
+
+def encode(data, fmt="binary"):
+    """
+    Serialise one reading dict (metrics plus "timestamp" and "context").
+    """
+    if fmt == "json":
+        return json.dumps(data).encode()
+    if fmt != "binary":
+        raise ValueError(f"format must be one of {FORMATS}, not {fmt!r}")
+    return READING.pack(VERSION, _CONTEXT_CODES.get(data["context"], UNKNOWN_CONTEXT),
+                        to_epoch_ms(data["timestamp"]), *_metric_values(data))
+
+
+def encode_frame(readings, fmt="binary"):
+    """
+    Serialise a list of reading dicts into one frame.
+    """
+    if fmt == "json":
+        return json.dumps({"samples": readings}).encode()
+    if fmt != "binary":
+        raise ValueError(f"format must be one of {FORMATS}, not {fmt!r}")
+    if len(readings) > MAX_FRAME_READINGS:
+        raise ValueError(f"a frame holds at most {MAX_FRAME_READINGS} readings")
+    stamps = [to_epoch_ms(data["timestamp"]) for data in readings]
+    base = min(stamps) if stamps else 0
+    parts = [FRAME_HEADER.pack(FRAME_VERSION, base, len(readings))]
+    for data, ts in zip(readings, stamps):
+        parts.append(FRAME_READING.pack(_CONTEXT_CODES.get(data["context"], UNKNOWN_CONTEXT), ts - base,
+                                        *_metric_values(data)))
+    return b"".join(parts)
+
+
+def decode(payload):
+    """
+    Reading dict from a JSON or binary payload. Binary readings come back
+    with the timestamp in epoch milliseconds, which health_db accepts as is.
+    """
+    if not payload:
+        raise PayloadError("empty payload")
+    if payload[0] == _JSON_FIRST_BYTE:
+        return json.loads(payload)
+    if payload[0] != VERSION:
+        raise PayloadError(f"unsupported payload version {payload[0]}")
+    if len(payload) != READING.size:
+        raise PayloadError(f"expected {READING.size} bytes, got {len(payload)}")
+    _, context, ts, *values = READING.unpack(payload)
+    return _reading(context, ts, values)
+
+
+def decode_readings(payload):
+    """
+    List of reading dicts from any payload: a single reading or a frame,
+    JSON or binary.
+    """
+    if payload and payload[0] == FRAME_VERSION:
+        if len(payload) < FRAME_HEADER.size:
+            raise PayloadError("truncated frame header")
+        _, base, count = FRAME_HEADER.unpack_from(payload)
+        expected = FRAME_HEADER.size + count * FRAME_READING.size
+        if len(payload) != expected:
+            raise PayloadError(f"expected {expected} bytes for {count} readings, got {len(payload)}")
+        return [_reading(context, base + offset, values)
+                for context, offset, *values in FRAME_READING.iter_unpack(memoryview(payload)[FRAME_HEADER.size:])]
+    data = decode(payload)
+    if isinstance(data, dict) and "samples" in data:
+        return data["samples"]
+    return [data]
@@ -1,8 +1,8 @@
-from max30102 import MAX30102
+from max30102 import MAX30102, output_rate_settings
+from collections import deque
 import hrcalc
 import threading
 import time
-import numpy as np
 
 
 class HeartRateMonitor(object):
@@ -11,53 +11,110 @@ class HeartRateMonitor(object):
     """
 
     LOOP_TIME = 0.01
+    # longest wait on the INT line before draining the FIFO anyway
+    INTERRUPT_TIMEOUT = 1.0
+    # seconds between FIFO stats lines when print_stats is set
+    STATS_INTERVAL = 10.0
+    # number of valid readings averaged into bpm
+    BPM_HISTORY = 4
+    # mean raw level below which no finger is on the sensor
+    FINGER_THRESHOLD = 50000
 
-    def __init__(self, print_raw=False, print_result=False):
+    def __init__(self, print_raw=False, print_result=False, interrupt=None, print_stats=False, bus=None,
+                 config=None):
+        """
+        Pass a sensor_interrupts backend as `interrupt` to sleep until the
+        FIFO is almost full instead of polling it every LOOP_TIME.
+        `bus` is handed to MAX30102 in place of the real SMBus.
+        `config` is an hrcalc.EstimatorConfig; the sensor is switched to its
+        sample rate if that differs from the setup() default. A rate the
+        sensor cannot produce raises ValueError here rather than in the
+        sensor thread.
+        """
         self.bpm = 0
+        self.spo2 = 0
         if print_raw is True:
             print('IR, Red')
         self.print_raw = print_raw
         self.print_result = print_result
+        self.print_stats = print_stats
+        self.interrupt = interrupt
+        self.bus = bus
+        # max30102.FifoStats of the running sensor
+        self.stats = None
+        self.estimates = 0
+        self.config = config or hrcalc.DEFAULT_CONFIG
+        output_rate_settings(self.config.sample_freq)
+        self.window = hrcalc.SlidingWindowEstimator(self.config)
+        self.reset()
+
+    def reset(self):
+        """
+        Forget all buffered samples and bpm history.
+        """
+        self.window.reset()
+        self._bpms = deque(maxlen=self.BPM_HISTORY)
+        self._bpm_sum = 0
+
+    def add_samples(self, red_samples, ir_samples):
+        """
+        Feed newly read samples and update bpm once a full window is available
+        and at least `config.hop` samples arrived since the last update.
+        """
+        window = self.window
+        for red, ir in zip(red_samples, ir_samples):
+            window.push(red, ir)
+            if self.print_raw:
+                print("{0}, {1}".format(ir, red))
+
+        if window.ready():
+            bpm, valid_bpm, spo2, valid_spo2 = window.estimate()
+            self.estimates += 1
+            if valid_spo2:
+                self.spo2 = spo2
+            if valid_bpm:
+                if len(self._bpms) == self._bpms.maxlen:
+                    self._bpm_sum -= self._bpms[0]
+                self._bpms.append(bpm)
+                self._bpm_sum += bpm
+                self.bpm = self._bpm_sum / len(self._bpms)
+                if (window.ir_mean < self.FINGER_THRESHOLD and window.red_mean < self.FINGER_THRESHOLD):
+                    self.bpm = 0
+                    if self.print_result:
+                        print("Finger not detected")
+                if self.print_result:
+                    print("BPM: {0}, SpO2: {1}".format(self.bpm, spo2))
 
     def run_sensor(self):
-        sensor = MAX30102()
-        ir_data = []
-        red_data = []
-        bpms = []
+        sensor = MAX30102(bus=self.bus)
+        if sensor.stats.configured_rate != self.config.sample_freq:
+            sensor.set_output_rate(self.config.sample_freq)
+        self.reset()
+        self.stats = sensor.stats
+        self.stats.reset()
+        self.estimates = 0
+        last_stats = time.monotonic()
+        if self.interrupt is not None:
+            # wake up on FIFO almost full only, not on every sample
+            sensor.enable_interrupts(a_full=True, ppg_rdy=False)
 
         # run until told to stop
         while not self._thread.stopped:
-            # check if any data is available
-            num_bytes = sensor.get_data_present()
-            if num_bytes > 0:
-                # grab all the data and stash it into arrays
-                while num_bytes > 0:
-                    red, ir = sensor.read_fifo()
-                    num_bytes -= 1
-                    ir_data.append(ir)
-                    red_data.append(red)
-                    if self.print_raw:
-                        print("{0}, {1}".format(ir, red))
+            if self.interrupt is not None:
+                # drain even on timeout so latency stays bounded
+                self.interrupt.wait(self.INTERRUPT_TIMEOUT)
 
-                while len(ir_data) > 100:
-                    ir_data.pop(0)
-                    red_data.pop(0)
+            # grab everything waiting in the FIFO in one burst
+            samples = sensor.read_fifo_burst()
+            if samples.shape[0] > 0:
+                self.add_samples(samples[:, 0], samples[:, 1])
 
-                if len(ir_data) == 100:
-                    bpm, valid_bpm, spo2, valid_spo2 = hrcalc.calc_hr_and_spo2(ir_data, red_data)
-                    if valid_bpm:
-                        bpms.append(bpm)
-                        while len(bpms) > 4:
-                            bpms.pop(0)
-                        self.bpm = np.mean(bpms)
-                        if (np.mean(ir_data) < 50000 and np.mean(red_data) < 50000):
-                            self.bpm = 0
-                            if self.print_result:
-                                print("Finger not detected")
-                        if self.print_result:
-                            print("BPM: {0}, SpO2: {1}".format(self.bpm, spo2))
+            if self.print_stats and time.monotonic() - last_stats >= self.STATS_INTERVAL:
+                last_stats = time.monotonic()
+                print("FIFO {0}, estimates: {1}".format(self.stats.summary(), self.estimates))
 
-            time.sleep(self.LOOP_TIME)
+            if self.interrupt is None:
+                time.sleep(self.LOOP_TIME)
 
         sensor.shutdown()
 
@@ -69,4 +126,5 @@ class HeartRateMonitor(object):
     def stop_sensor(self, timeout=2.0):
         self._thread.stopped = True
         self.bpm = 0
-        self._thread.join(timeout)
\ No newline at end of file
+        self.spo2 = 0
+        self._thread.join(timeout)
@@ -1,5 +1,6 @@
 # -*-coding:utf-8
 
+import math
 import numpy as np
 
 # 25 samples per second (in algorithm.h)
@@ -10,13 +11,79 @@ MA_SIZE = 4
 # sampling frequency * 4 (in algorithm.h)
 BUFFER_SIZE = 100
 
+# calc_hr_and_spo2 runs the NumPy engine unless told otherwise.
+# set this to False to fall back to the loop-based port of algorithm.cpp
+USE_VECTORIZED = True
+
+
+class EstimatorConfig(object):
+    """
+    Parameters of the HR/SpO2 estimator. The defaults are the constants of
+    algorithm.h: 25 Hz, a 100-sample window recomputed on every new sample,
+    4-sample moving average, valley threshold clamped to 30..60, valleys at
+    least 4 samples apart and at most 15 of them.
+    """
+
+    def __init__(self, sample_freq=SAMPLE_FREQ, window=BUFFER_SIZE, hop=1, ma_size=MA_SIZE,
+                 min_height=30, max_height=60, min_dist=4, max_num=15):
+        if window <= ma_size:
+            raise ValueError("window must be longer than the {0}-sample moving average".format(ma_size))
+        if hop < 1:
+            raise ValueError("hop must be at least one sample")
+        self.sample_freq = sample_freq
+        self.window = window
+        self.hop = hop
+        self.ma_size = ma_size
+        self.min_height = min_height
+        self.max_height = max_height
+        self.min_dist = min_dist
+        self.max_num = max_num
+
+    @classmethod
+    def for_rate(cls, sample_freq, window_seconds=4.0, hop_seconds=None):
+        """
+        Scale the algorithm.h defaults to another sample rate and window
+        length, keeping the same timing in seconds. hop_seconds=None
+        recomputes on every sample.
+        """
+        scale = sample_freq / float(SAMPLE_FREQ)
+        hop = 1 if hop_seconds is None else max(1, int(round(hop_seconds * sample_freq)))
+        return cls(sample_freq=sample_freq,
+                   window=int(round(window_seconds * sample_freq)),
+                   hop=hop,
+                   ma_size=max(1, int(round(MA_SIZE * scale))),
+                   min_dist=max(1, int(round(4 * scale))),
+                   max_num=max(15, int(math.ceil(15 * window_seconds / 4.0))))
+
+    def is_default(self):
+        return (self.sample_freq, self.window, self.ma_size, self.min_height, self.max_height,
+                self.min_dist, self.max_num) == (SAMPLE_FREQ, BUFFER_SIZE, MA_SIZE, 30, 60, 4, 15)
+
+    def __repr__(self):
+        return ("EstimatorConfig(sample_freq={0}, window={1}, hop={2}, ma_size={3}, min_height={4}, "
+                "max_height={5}, min_dist={6}, max_num={7})").format(
+                    self.sample_freq, self.window, self.hop, self.ma_size, self.min_height,
+                    self.max_height, self.min_dist, self.max_num)
+
+
+DEFAULT_CONFIG = EstimatorConfig()
+
 
 # this assumes ir_data and red_data as np.array
-def calc_hr_and_spo2(ir_data, red_data):
+def calc_hr_and_spo2(ir_data, red_data, vectorized=None, config=None):
     """
     By detecting  peaks of PPG cycle and corresponding AC/DC
     of red/infra-red signal, the an_ratio for the SPO2 is computed.
+    `vectorized` selects the engine, None means USE_VECTORIZED.
+    `config` is an EstimatorConfig; the loop engine only knows the defaults.
     """
+    if vectorized is None:
+        vectorized = USE_VECTORIZED
+    if vectorized:
+        return calc_hr_and_spo2_vectorized(ir_data, red_data, config)
+    if config is not None and not config.is_default():
+        raise ValueError("the loop engine only supports the algorithm.h constants")
+
     # get dc mean
     ir_mean = int(np.mean(ir_data))
 
@@ -122,6 +189,349 @@ def calc_hr_and_spo2(ir_data, red_data):
     return hr, hr_valid, spo2, spo2_valid
 
 
+def calc_hr_and_spo2_vectorized(ir_data, red_data, config=None):
+    """
+    NumPy engine for calc_hr_and_spo2.
+    Returns exactly what the loop version returns (same integer truncation
+    and the same 32-bit overflow on the ratio), without per-sample loops.
+    """
+    config = config or DEFAULT_CONFIG
+    ma_size = config.ma_size
+    ir_data = np.asarray(ir_data, dtype=np.int64)
+    red_data = np.asarray(red_data, dtype=np.int64)
+
+    # remove DC mean and invert signal
+    ir_mean = int(np.mean(ir_data))
+    x = ir_mean - ir_data
+
+    # 4 point moving average as a convolution.
+    # assigning the float sums back into the int array truncates toward zero,
+    # which is what the loop version does element by element
+    n_avg = x.shape[0] - ma_size
+    if n_avg > 0:
+        sums = np.convolve(x, np.ones(ma_size, dtype=np.int64), mode="valid")
+        x[:n_avg] = sums[:n_avg] / ma_size
+
+    return _hr_and_spo2_from_signal(x, ir_data, red_data, config)
+
+
+def _hr_and_spo2_from_signal(x, ir_data, red_data, config):
+    """
+    Everything after the moving average: threshold, valleys, HR and SpO2.
+    `x` is the inverted, averaged IR signal, the data arrays are raw int64.
+    """
+    # calculate threshold
+    n_th = int(np.mean(x))
+    n_th = config.min_height if n_th < config.min_height else n_th  # min allowed
+    n_th = config.max_height if n_th > config.max_height else n_th  # max allowed
+
+    ir_valley_locs, n_peaks = find_peaks(x, config.window, n_th, config.min_dist, config.max_num)
+    locs = np.asarray(ir_valley_locs[:n_peaks], dtype=np.int64)
+
+    if n_peaks >= 2:
+        # sum of the intervals between neighbouring valleys is last - first
+        peak_interval = int((locs[-1] - locs[0]) / (n_peaks - 1))
+        hr = int(config.sample_freq * 60 / peak_interval)
+        hr_valid = True
+    else:
+        hr = -999  # unable to calculate because # of peaks are too small
+        hr_valid = False
+
+    # ---------spo2---------
+
+    if n_peaks < 2:
+        return hr, hr_valid, -999, False
+    if locs[-1] > config.window:
+        return hr, hr_valid, -999, False  # valley loc is out of range
+
+    ratio = _calc_ratios(ir_data, red_data, locs)
+    ratio_ave = _median_ratio(ratio)
+
+    if ratio_ave > 2 and ratio_ave < 184:
+        spo2 = -45.060 * (ratio_ave**2) / 10000.0 + 30.054 * ratio_ave / 100.0 + 94.845
+        spo2_valid = True
+    else:
+        spo2 = -999
+        spo2_valid = False
+
+    return hr, hr_valid, spo2, spo2_valid
+
+
+class SlidingWindowEstimator(object):
+    """
+    Keeps the latest `config.window` samples and gives the same result as
+    calc_hr_and_spo2 on them. The DC sums and the moving-average sums are
+    updated per pushed sample, so nothing is rebuilt from Python lists.
+    ready() says when `config.hop` new samples arrived since the last estimate.
+    """
+
+    def __init__(self, config=None):
+        self.config = config = config or DEFAULT_CONFIG
+        self.size = size = config.window
+        self.ma_size = config.ma_size
+        # every sample is written twice, `size` apart, so the current window
+        # is always the contiguous slice [pos, pos + size) without copying
+        self._ir = np.zeros(2 * size, dtype=np.int64)
+        self._red = np.zeros(2 * size, dtype=np.int64)
+        # raw ma_size-sample IR sums, stored at the slot of their first sample
+        self._ma_sums = np.zeros(2 * size, dtype=np.int64)
+        self.reset()
+
+    def reset(self):
+        self._pos = 0
+        self.count = 0
+        self.ir_sum = 0
+        self.red_sum = 0
+        self._tail_sum = 0  # sum of the latest ma_size IR samples
+        self._since_estimate = 0
+
+    @property
+    def full(self):
+        return self.count >= self.size
+
+    def ready(self):
+        """
+        True once the window is full and `hop` samples came in since the
+        last estimate().
+        """
+        return self.full and self._since_estimate >= self.config.hop
+
+    @property
+    def ir_mean(self):
+        return self.ir_sum / min(self.count, self.size) if self.count else 0.0
+
+    @property
+    def red_mean(self):
+        return self.red_sum / min(self.count, self.size) if self.count else 0.0
+
+    def push(self, red, ir):
+        """
+        Add one sample, dropping the oldest once the window is full.
+        """
+        size = self.size
+        ma_size = self.ma_size
+        pos = self._pos
+        red = int(red)
+        ir = int(ir)
+
+        if self.count >= size:
+            # the sample in this slot is leaving the window
+            self.ir_sum -= int(self._ir[pos])
+            self.red_sum -= int(self._red[pos])
+        if self.count >= ma_size:
+            self._tail_sum -= int(self._ir[(pos - ma_size) % size])
+
+        self._ir[pos] = self._ir[pos + size] = ir
+        self._red[pos] = self._red[pos + size] = red
+        self.ir_sum += ir
+        self.red_sum += red
+        self._tail_sum += ir
+        self.count += 1
+        self._since_estimate += 1
+
+        if self.count >= ma_size:
+            first = (pos - ma_size + 1) % size
+            self._ma_sums[first] = self._ma_sums[first + size] = self._tail_sum
+
+        self._pos = (pos + 1) % size
+
+    def extend(self, red_samples, ir_samples):
+        for red, ir in zip(red_samples, ir_samples):
+            self.push(red, ir)
+
+    def window(self):
+        """
+        Views of the current (ir, red) window, oldest sample first.
+        """
+        pos = self._pos
+        return self._ir[pos:pos + self.size], self._red[pos:pos + self.size]
+
+    def estimate(self):
+        """
+        calc_hr_and_spo2 on the current window, built from the kept sums.
+        """
+        if not self.full:
+            raise ValueError("window holds {0} of {1} samples".format(self.count, self.size))
+        self._since_estimate = 0
+        ir_data, red_data = self.window()
+        ir_mean = int(self.ir_sum / self.size)
+        x = ir_mean - ir_data
+
+        # sum of ma_size inverted samples is ma_size * mean - raw sum
+        n_avg = self.size - self.ma_size
+        if n_avg > 0:
+            sums = self._ma_sums[self._pos:self._pos + n_avg]
+            x[:n_avg] = (self.ma_size * ir_mean - sums) / self.ma_size
+
+        return _hr_and_spo2_from_signal(x, ir_data, red_data, self.config)
+
+
+def calc_hr_and_spo2_batch(ir_windows, red_windows, config=None):
+    """
+    calc_hr_and_spo2 for a stack of windows in one call.
+    ir_windows and red_windows are (N, config.window) arrays with one window
+    per row. Returns hr, hr_valid, spo2 and spo2_valid as arrays of length N,
+    where row k equals calc_hr_and_spo2(ir_windows[k], red_windows[k], config=config).
+    """
+    config = config or DEFAULT_CONFIG
+    ma_size = config.ma_size
+    ir = np.atleast_2d(np.asarray(ir_windows, dtype=np.int64))
+    red = np.atleast_2d(np.asarray(red_windows, dtype=np.int64))
+    if ir.shape != red.shape:
+        raise ValueError("ir and red windows differ in shape: {0} vs {1}".format(ir.shape, red.shape))
+    if ir.ndim != 2 or ir.shape[1] != config.window:
+        raise ValueError("windows must be (N, {0}), got {1}".format(config.window, ir.shape))
+    n_rows, size = ir.shape
+
+    # remove DC mean and invert signal, row by row
+    ir_mean = np.trunc(np.mean(ir, axis=1)).astype(np.int64)
+    x = ir_mean[:, None] - ir
+
+    # 4 point moving average along each row
+    n_avg = size - ma_size
+    csum = np.zeros((n_rows, size + 1), dtype=np.int64)
+    np.cumsum(x, axis=1, out=csum[:, 1:])
+    x[:, :n_avg] = (csum[:, ma_size:ma_size + n_avg] - csum[:, :n_avg]) / ma_size
+
+    # threshold per row
+    n_th = np.clip(np.trunc(np.mean(x, axis=1)), config.min_height, config.max_height).astype(np.int64)
+
+    # peak detection is sequential within a row, so only this step loops
+    row_locs = []
+    for k in range(n_rows):
+        ir_valley_locs, n_peaks = find_peaks(x[k], size, int(n_th[k]), config.min_dist, config.max_num)
+        row_locs.append(np.asarray(ir_valley_locs[:n_peaks], dtype=np.int64))
+    n_peaks = np.array([locs.shape[0] for locs in row_locs], dtype=np.int64)
+
+    # ---------hr---------
+
+    hr = np.full(n_rows, -999, dtype=np.int64)
+    hr_valid = n_peaks >= 2
+    first = np.array([locs[0] if locs.shape[0] else 0 for locs in row_locs], dtype=np.int64)
+    last = np.array([locs[-1] if locs.shape[0] else 0 for locs in row_locs], dtype=np.int64)
+    peak_interval = _trunc_div(last[hr_valid] - first[hr_valid], n_peaks[hr_valid] - 1)
+    hr[hr_valid] = _trunc_div(config.sample_freq * 60, peak_interval)
+
+    # ---------spo2---------
+
+    spo2 = np.full(n_rows, -999.0)
+    spo2_valid = np.zeros(n_rows, dtype=bool)
+
+    # lay all valleys out on the flattened signal so every row is
+    # handled by the same segment reductions
+    use_row = hr_valid & (last <= config.window)
+    if not use_row.any():
+        return hr, hr_valid, spo2, spo2_valid
+    rows = np.flatnonzero(use_row)
+    loc_rows = np.repeat(rows, n_peaks[rows])
+    flat_locs = np.concatenate([row_locs[k] for k in rows]) + loc_rows * size
+
+    nume, denom, usable = _valley_pair_terms(ir.ravel(), red.ravel(), flat_locs)
+    pair_rows = loc_rows[:-1]
+    usable &= pair_rows == loc_rows[1:]  # drop pairs that straddle two windows
+
+    # keep the first 5 usable pairs of each row
+    pair_rows = pair_rows[usable]
+    rank = np.arange(pair_rows.shape[0]) - np.searchsorted(pair_rows, pair_rows)
+    keep = rank < 5
+    ratio = _overflow_ratio(nume[usable][keep], denom[usable][keep])
+    pair_rows = pair_rows[keep]
+    rank = rank[keep]
+
+    # median per row, same rules as _median_ratio
+    count = np.bincount(pair_rows, minlength=n_rows)
+    table = np.full((n_rows, 5), np.iinfo(np.int64).max, dtype=np.int64)
+    table[pair_rows, rank] = ratio
+    table.sort(axis=1)
+    mid_index = count // 2
+    upper = np.take_along_axis(table, np.minimum(mid_index, 4)[:, None], axis=1)[:, 0]
+    lower = np.take_along_axis(table, np.maximum(mid_index - 1, 0)[:, None], axis=1)[:, 0]
+    ratio_ave = np.where(mid_index > 1, _trunc_div(lower + np.where(mid_index > 1, upper, 0), 2), upper)
+    ratio_ave = np.where(count > 0, ratio_ave, 0)
+
+    spo2_valid = (ratio_ave > 2) & (ratio_ave < 184)
+    r = ratio_ave[spo2_valid]
+    spo2[spo2_valid] = -45.060 * (r**2) / 10000.0 + 30.054 * r / 100.0 + 94.845
+
+    return hr, hr_valid, spo2, spo2_valid
+
+
+def _trunc_div(a, b):
+    """
+    Element-wise int(a / b), i.e. true division truncated toward zero.
+    """
+    return np.trunc(a / b).astype(np.int64)
+
+
+def _segment_argmax(data, bounds):
+    """
+    Maximum of data[bounds[k]:bounds[k+1]] for every k and the first index
+    where it occurs. `bounds` has to be strictly increasing.
+    """
+    lo = bounds[0]
+    hi = bounds[-1]
+    seg = data[lo:hi]
+    offsets = bounds[:-1] - lo
+    seg_max = np.maximum.reduceat(seg, offsets)
+    is_max = seg == np.repeat(seg_max, np.diff(bounds))
+    pos = np.where(is_max, np.arange(lo, hi), hi)
+    return seg_max, np.minimum.reduceat(pos, offsets)
+
+
+def _valley_pair_terms(ir_data, red_data, locs):
+    """
+    Numerator, denominator and usability of the AC/DC ratio for every pair
+    of consecutive valleys in `locs`.
+    """
+    v0 = locs[:-1]
+    v1 = locs[1:]
+    width = v1 - v0
+
+    # find max between two valley locations
+    ir_dc_max, ir_dc_max_index = _segment_argmax(ir_data, locs)
+    red_dc_max, red_dc_max_index = _segment_argmax(red_data, locs)
+
+    # subtract linear DC components from raw
+    red_ac = red_data[v0] + _trunc_div((red_data[v1] - red_data[v0]) * (red_dc_max_index - v0), width)
+    red_ac = red_data[red_dc_max_index] - red_ac
+    ir_ac = ir_data[v0] + _trunc_div((ir_data[v1] - ir_data[v0]) * (ir_dc_max_index - v0), width)
+    ir_ac = ir_data[ir_dc_max_index] - ir_ac
+
+    nume = red_ac * ir_dc_max
+    denom = ir_ac * red_dc_max
+    usable = (width > 3) & (denom > 0) & (nume != 0)
+    return nume, denom, usable
+
+
+def _overflow_ratio(nume, denom):
+    """
+    Same 32-bit overflow emulation as the loop version.
+    """
+    return _trunc_div((nume * 100) & 0xffffffff, denom)
+
+
+def _calc_ratios(ir_data, red_data, locs):
+    """
+    AC/DC ratios between consecutive valleys, at most 5 of them,
+    in the same order the loop version collects them.
+    """
+    nume, denom, usable = _valley_pair_terms(ir_data, red_data, locs)
+    return _overflow_ratio(nume[usable][:5], denom[usable][:5])
+
+
+def _median_ratio(ratio):
+    """
+    Median of the ratios the way algorithm.cpp takes it.
+    """
+    ratio = np.sort(ratio)
+    mid_index = int(ratio.shape[0] / 2)
+    if mid_index > 1:
+        return int((ratio[mid_index-1] + ratio[mid_index]) / 2)
+    if ratio.shape[0] != 0:
+        return int(ratio[mid_index])
+    return 0
+
+
 def find_peaks(x, size, min_height, min_dist, max_num):
     """
     Find at most MAX_NUM peaks above MIN_HEIGHT separated by at least MIN_DISTANCE
@@ -138,58 +548,56 @@ def find_peaks_above_min_height(x, size, min_height, max_num):
     """
     Find all peaks above MIN_HEIGHT
     """
+    # the loop in algorithm.cpp visits the left edge of every rising step,
+    # skips over flat tops and keeps the edge if the signal falls right after
+    # the flat part. the samples it jumps over can never be such an edge, so
+    # checking every index at once gives the same peaks in the same order.
+    x = np.asarray(x)
+    if size < 2:
+        return [], 0
+    body = x[:size]
+    left = body[:-1]
 
-    i = 0
-    n_peaks = 0
-    ir_valley_locs = []  # [0 for i in range(max_num)]
-    while i < size - 1:
-        if x[i] > min_height and x[i] > x[i-1]:  # find the left edge of potential peaks
-            n_width = 1
-            # original condition i+n_width < size may cause IndexError
-            # so I changed the condition to i+n_width < size - 1
-            while i + n_width < size - 1 and x[i] == x[i+n_width]:  # find flat peaks
-                n_width += 1
-            if x[i] > x[i+n_width] and n_peaks < max_num:  # find the right edge of peaks
-                # ir_valley_locs[n_peaks] = i
-                ir_valley_locs.append(i)
-                n_peaks += 1  # original uses post increment
-                i += n_width + 1
-            else:
-                i += n_width
-        else:
-            i += 1
+    # x[i-1], where i = 0 wraps around to the last sample like the original
+    prev = np.empty_like(left)
+    prev[0] = x[-1]
+    prev[1:] = body[:-2]
 
-    return ir_valley_locs, n_peaks
+    # index of the first sample after i that differs from x[i],
+    # capped at size - 1 like the flat-peak loop
+    diff_at = np.full(size + 1, size - 1, dtype=np.int64)
+    diff_at[1:size] = np.where(body[1:] != body[:-1], np.arange(1, size), size - 1)
+    next_diff = np.minimum.accumulate(diff_at[::-1])[::-1][1:size]
+
+    is_peak = (left > min_height) & (left > prev) & (left > body[next_diff])
+    ir_valley_locs = np.flatnonzero(is_peak)[:max_num].tolist()
+
+    return ir_valley_locs, len(ir_valley_locs)
 
 
 def remove_close_peaks(n_peaks, ir_valley_locs, x, min_dist):
     """
     Remove peaks separated by less than MIN_DISTANCE
     """
-
-    # should be equal to maxim_sort_indices_descend
-    # order peaks from large to small
-    # should ignore index:0
-    sorted_indices = sorted(ir_valley_locs, key=lambda i: x[i])
-    sorted_indices.reverse()
-
-    # this "for" loop expression does not check finish condition
-    # for i in range(-1, n_peaks):
-    i = -1
-    while i < n_peaks:
-        old_n_peaks = n_peaks
-        n_peaks = i + 1
-        # this "for" loop expression does not check finish condition
-        # for j in (i + 1, old_n_peaks):
-        j = i + 1
-        while j < old_n_peaks:
-            n_dist = (sorted_indices[j] - sorted_indices[i]) if i != -1 else (sorted_indices[j] + 1)  # lag-zero peak of autocorr is at index -1
-            if n_dist > min_dist or n_dist < -1 * min_dist:
-                sorted_indices[n_peaks] = sorted_indices[j]
-                n_peaks += 1  # original uses post increment
-            j += 1
-        i += 1
-
-    sorted_indices[:n_peaks] = sorted(sorted_indices[:n_peaks])
-
-    return sorted_indices, n_peaks
+    locs = np.asarray(ir_valley_locs, dtype=np.int64)
+    if n_peaks <= 0 or locs.shape[0] == 0:
+        return [], 0
+
+    # order peaks from large to small like maxim_sort_indices_descend,
+    # equal heights keep the reversed input order of the original sort
+    order = np.lexsort((np.arange(locs.shape[0]), np.asarray(x)[locs]))[::-1]
+    candidates = locs[order][:n_peaks].tolist()
+
+    # greedy suppression in height order: every kept peak blocks the
+    # samples within MIN_DISTANCE of it, so each check is a single lookup
+    blocked = np.zeros(max(candidates) + min_dist + 2, dtype=bool)
+    if min_dist > 0:
+        blocked[:min_dist] = True  # lag-zero peak of autocorr is at index -1
+    kept = []
+    for loc in candidates:
+        if not blocked[loc]:
+            kept.append(loc)
+            blocked[max(loc - min_dist, 0):loc + min_dist + 1] = True
+
+    kept.sort()
+    return kept, len(kept)
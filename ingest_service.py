@@ -0,0 +1,118 @@
+import threading
+
+import paho.mqtt.client as mqtt
+
+from health_cache import HealthDataCache
+from health_db import DB_PATH, HealthDataWriter, row_from_reading
+from health_payload import decode_readings
+from insight_detector import InsightDetector
+
+BROKER = "broker.hivemq.com"
+PORT = 1883
+TOPIC = "health_sensor/data"
+
+
+class IngestService(object):
+    """
+    The one MQTT subscriber of a dashboard process.
+
+    Every message (a single reading or a frame of them) is decoded once,
+    written once as a bulk insert (HealthDataWriter with the insight
+    detector), added once to the shared HealthDataCache and its readings
+    handed to any callbacks registered with subscribe(). Browser sessions
+    read the cache, so the ingest cost does not depend on how many are open.
+    """
+
+    def __init__(self, broker=BROKER, port=PORT, topic=TOPIC, path=DB_PATH, verbose=False):
+        self.broker = broker
+        self.port = port
+        self.topic = topic
+        self.verbose = verbose
+
+        self.writer = HealthDataWriter(path, flush_interval=1.0, detector=InsightDetector())
+        self.cache = HealthDataCache(path)
+
+        self._subscribers = {}
+        self._next_token = 0
+        self._lock = threading.Lock()
+
+        self.connected = False
+        self.messages = 0
+        self.readings = 0
+        self.errors = 0
+        self.client = None
+
+    def start(self):
+        self.client = mqtt.Client()
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = self._on_message
+        self.client.connect(self.broker, self.port, 60)
+        self.client.loop_start()
+        return self
+
+    def stop(self):
+        if self.client is not None:
+            self.client.loop_stop()
+            self.client.disconnect()
+            self.client = None
+        self.writer.close()
+        self.cache.close()
+
+    def subscribe(self, callback):
+        """
+        Call callback(data) for every reading from now on. Returns a token
+        for unsubscribe().
+        """
+        with self._lock:
+            token = self._next_token
+            self._next_token += 1
+            self._subscribers[token] = callback
+        return token
+
+    def unsubscribe(self, token):
+        with self._lock:
+            self._subscribers.pop(token, None)
+
+    def ingest(self, readings):
+        """
+        Store a list of reading dicts and fan them out.
+        """
+        rows = [row_from_reading(data) for data in readings]
+        self.writer.write_rows(rows)
+        self.cache.add_rows(rows)
+        self.messages += 1
+        self.readings += len(readings)
+        with self._lock:
+            callbacks = list(self._subscribers.values())
+        for callback in callbacks:
+            for data in readings:
+                try:
+                    callback(data)
+                except Exception as e:
+                    print(f"Ingest subscriber failed: {e}")
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            print("Successfully connected to broker")
+            # (re)subscribe on every connect so a reconnect keeps receiving;
+            # "<topic>/#" also matches <topic> itself, so this gets JSON
+            # readings and every binary version (see health_payload)
+            client.subscribe(f"{self.topic}/#")
+            self.connected = True
+        else:
+            print(f"Connection failed with code {rc}")
+
+    def _on_disconnect(self, client, userdata, rc):
+        self.connected = False
+
+    def _on_message(self, client, userdata, msg):
+        try:
+            readings = decode_readings(msg.payload)
+            self.ingest(readings)
+        except Exception as e:
+            self.errors += 1
+            print(f"Dropped message on {msg.topic}: {e}")
+            return
+        if self.verbose and readings:
+            print(f"Received {len(readings)} reading(s) (Context: {readings[-1]['context']}): {readings[-1]}")
@@ -0,0 +1,161 @@
+import math
+
+from health_db import METRIC_COLUMNS, from_epoch_ms
+
+# metric -> detector settings. step is the jump between consecutive readings
+# that counts as significant (the thresholds the dashboard used to apply to
+# the last 10 readings); min_std stops the z-score from exploding while the
+# signal is flat or quantised (the PCT2075 reads in 0.125 °C steps).
+DETECTED_METRICS = {
+    "Heart_Rate": {"step": 10.0, "min_std": 2.0},
+    "Body_Temperature": {"step": 1.0, "min_std": 0.1},
+}
+
+
+class InsightEvent(object):
+    """
+    Something worth pointing out in one metric.
+
+    kind is "step" (jump between consecutive readings), "spike" (reading far
+    outside the recent mean) or "shift" (the level moved and stayed there).
+    """
+
+    KINDS = ("step", "spike", "shift")
+
+    def __init__(self, ts, metric, kind, value, baseline, score, context):
+        self.ts = ts
+        self.metric = metric
+        self.kind = kind
+        self.value = value
+        self.baseline = baseline
+        self.score = score
+        self.context = context
+
+    def as_row(self):
+        return (self.ts, self.metric, self.kind, self.value, self.baseline, self.score, self.context)
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row)
+
+    @property
+    def message(self):
+        timestamp = from_epoch_ms(self.ts)
+        if self.kind == "step":
+            return (f"Significant change in {self.metric}: {self.value:.2f} at {timestamp} "
+                    f"(change of {abs(self.value - self.baseline):.2f})")
+        if self.kind == "spike":
+            return (f"Unusual {self.metric} reading: {self.value:.2f} at {timestamp} "
+                    f"({self.score:+.1f} standard deviations from the recent mean of {self.baseline:.2f})")
+        direction = "upward" if self.value > self.baseline else "downward"
+        return (f"Sustained {direction} shift in {self.metric}: {self.value:.2f} at {timestamp} "
+                f"(recent mean was {self.baseline:.2f})")
+
+    def __repr__(self):
+        return f"InsightEvent({self.kind} {self.metric}={self.value:.2f} at {self.ts}, score {self.score:.2f})"
+
+
+class MetricDetector(object):
+    """
+    Constant-size detection state for one metric.
+
+    Keeps an exponentially weighted mean and variance (so the z-score needs
+    no window of past readings), the previous reading for step changes and
+    two-sided CUSUM sums on the z-score for level shifts. The z-score fed to
+    CUSUM is clipped at cusum_clip, so a single outlier cannot pass for a
+    shift. A reading raises at most one event, the most specific of shift,
+    spike and step.
+    """
+
+    def __init__(self, metric, step, min_std, alpha=0.05, z_threshold=4.0, cusum_k=0.5, cusum_h=8.0,
+                 cusum_clip=3.0, warmup=20, cooldown=30000):
+        self.metric = metric
+        self.step = step
+        self.min_std = min_std
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.cusum_k = cusum_k
+        self.cusum_h = cusum_h
+        self.cusum_clip = cusum_clip
+        self.warmup = warmup
+        self.cooldown = cooldown
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+        self.last = None
+        self.cusum_pos = 0.0
+        self.cusum_neg = 0.0
+        self.last_event = {}
+
+    def update(self, ts, value, context):
+        """
+        Feed one reading (ts in epoch ms). Returns the InsightEvents it raised.
+        """
+        candidates = []
+        if self.count == 0:
+            self.mean = value
+        std = max(math.sqrt(self.var), self.min_std)
+        z = (value - self.mean) / std
+        baseline = self.mean
+        if self.count >= self.warmup:
+            clipped = max(-self.cusum_clip, min(self.cusum_clip, z))
+            self.cusum_pos = max(0.0, self.cusum_pos + clipped - self.cusum_k)
+            self.cusum_neg = max(0.0, self.cusum_neg - clipped - self.cusum_k)
+            if self.cusum_pos > self.cusum_h or self.cusum_neg > self.cusum_h:
+                score = self.cusum_pos if self.cusum_pos > self.cusum_h else -self.cusum_neg
+                candidates.append(("shift", baseline, score))
+                # start over from the new level
+                self.cusum_pos = self.cusum_neg = 0.0
+                self.mean = value
+            if abs(z) > self.z_threshold:
+                candidates.append(("spike", baseline, z))
+        if self.last is not None and abs(value - self.last) > self.step:
+            candidates.append(("step", self.last, value - self.last))
+        self.last = value
+
+        delta = value - self.mean
+        self.mean += self.alpha * delta
+        self.var = (1 - self.alpha) * (self.var + self.alpha * delta * delta)
+        self.count += 1
+
+        # one event per kind every `cooldown` ms, so a single episode does
+        # not flood the dashboard
+        for kind, reference, score in candidates:
+            if ts - self.last_event.get(kind, -self.cooldown) >= self.cooldown:
+                self.last_event[kind] = ts
+                return [InsightEvent(ts, self.metric, kind, value, reference, score, context)]
+        return []
+
+
+class InsightDetector(object):
+    """
+    Runs a MetricDetector for every metric in DETECTED_METRICS over samples
+    rows as they are ingested.
+    """
+
+    def __init__(self, metrics=None, **kwargs):
+        metrics = DETECTED_METRICS if metrics is None else metrics
+        self.detectors = {metric: MetricDetector(metric, **dict(settings, **kwargs))
+                          for metric, settings in metrics.items()}
+        self._columns = [(k, metric) for k, metric in enumerate(METRIC_COLUMNS) if metric in self.detectors]
+        self.last_ts = None
+
+    def process_rows(self, rows):
+        """
+        Feed samples rows (see health_db.row_from_reading) in time order.
+        Rows not newer than the last one seen are skipped.
+        """
+        events = []
+        for row in rows:
+            ts, context = row[0], row[1]
+            if self.last_ts is not None and ts <= self.last_ts:
+                continue
+            self.last_ts = ts
+            for k, metric in self._columns:
+                value = row[2 + k]
+                if value is not None:
+                    events.extend(self.detectors[metric].update(ts, value, context))
+        return events
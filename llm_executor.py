@@ -0,0 +1,192 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class LLMRequest(object):
+    """
+    Handle for one prompt submitted to an LLMExecutor.
+
+    text grows as chunks stream in. status is "pending", "running", "done",
+    "failed", "cancelled" or "timed_out"; the last four are final. A request
+    still running past its deadline is reported as timed out as soon as
+    anyone looks at it, even if the model call itself cannot be interrupted.
+    """
+
+    FINAL = ("done", "failed", "cancelled", "timed_out")
+
+    def __init__(self, prompt, key=None, kind=None, timeout=None):
+        self.prompt = prompt
+        self.key = key
+        self.kind = kind
+        self.submitted = time.time()
+        self.deadline = None if timeout is None else self.submitted + timeout
+        self.finished = None
+        self.cached = False
+        self.error = None
+        self.text = ""
+        self.future = None
+        # called with the request once it reaches a final status
+        self.on_finish = None
+        self._status = "pending"
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    @property
+    def status(self):
+        if self.deadline is not None and not self._done.is_set() and time.time() > self.deadline:
+            self._finish("timed_out", TimeoutError(f"no complete response after {self.deadline - self.submitted:g}s"))
+        return self._status
+
+    def done(self):
+        return self.status in self.FINAL
+
+    def cancel(self):
+        """
+        Stop the request. A queued request never runs; a running one stops
+        at the next chunk. Returns False if it had already finished.
+        """
+        if self.future is not None:
+            self.future.cancel()
+        return self._finish("cancelled")
+
+    def result(self, timeout=None):
+        """
+        Wait for the full text. Raises the request's error if it did not
+        finish as "done".
+        """
+        wait = timeout
+        if self.deadline is not None:
+            left = max(0.0, self.deadline - time.time())
+            wait = left if wait is None else min(wait, left)
+        self._done.wait(wait)
+        status = self.status
+        if status == "done":
+            return self.text
+        if status in ("pending", "running"):
+            raise TimeoutError("request still running")
+        raise self.error
+
+    def _start(self):
+        with self._lock:
+            if self._status != "pending":
+                return False
+            self._status = "running"
+            return True
+
+    def _append(self, chunk):
+        with self._lock:
+            if self._status != "running":
+                return False
+            self.text += chunk
+            return True
+
+    def _finish(self, status, error=None):
+        with self._lock:
+            if self._status in self.FINAL:
+                return False
+            self._status = status
+            if error is None and status == "cancelled":
+                error = RuntimeError("request cancelled")
+            self.error = error
+            self.finished = time.time()
+        self._done.set()
+        if self.on_finish is not None:
+            self.on_finish(self)
+        return True
+
+    def __repr__(self):
+        return f"LLMRequest({self.kind or 'prompt'} {self._status}, {len(self.text)} chars)"
+
+
+class LLMExecutor(object):
+    """
+    Runs GeminiClient calls on a small thread pool so the dashboard never
+    waits on Gemini.
+
+    submit() returns an LLMRequest at once. Responses are streamed
+    (generate_content(prompt, stream=True)) into the handle chunk by chunk.
+    A submit with the key of a request still in flight gets that same
+    handle instead of a second API call (so cancelling it cancels it for
+    everyone holding it), and with a GeminiResponseCache cached keys come
+    back already done and finished responses are stored. The client gets
+    each request's deadline, so a worker is not kept waiting on the rate
+    limiter or retries long after the request timed out.
+
+    With batch=True requests go through the client's generate_batched()
+    and the text arrives in one piece.
+    """
+
+    def __init__(self, model, workers=2, timeout=60.0, cache=None, batch=False):
+        self.model = model
+        self.timeout = timeout
+        self.cache = cache
+        self.batch = batch
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm")
+        self._inflight = {}
+        # reentrant: a request checked under it may time out and call _forget
+        self._lock = threading.RLock()
+
+        self.submitted = 0
+        self.coalesced = 0
+        self.cache_hits = 0
+
+    def submit(self, prompt, key=None, kind=None, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        with self._lock:
+            self.submitted += 1
+            if key is not None:
+                request = self._inflight.get(key)
+                if request is not None and not request.done():
+                    self.coalesced += 1
+                    return request
+                cached = self.cache.get(key) if self.cache is not None else None
+                if cached is not None:
+                    self.cache_hits += 1
+                    request = LLMRequest(prompt, key, kind)
+                    request.cached = True
+                    request.text = cached
+                    request._finish("done")
+                    return request
+            request = LLMRequest(prompt, key, kind, timeout)
+            if key is not None:
+                self._inflight[key] = request
+                # however it ends (even cancelled or timed out before a
+                # worker picked it up) the key is free again
+                request.on_finish = self._forget
+            request.future = self._pool.submit(self._run, request)
+        return request
+
+    def _run(self, request):
+        try:
+            if not request._start():
+                return
+            if self.batch:
+                chunks = [self.model.generate_batched(request.prompt, deadline=request.deadline)]
+            else:
+                response = self.model.generate_content(request.prompt, stream=True, deadline=request.deadline)
+                chunks = (chunk.text for chunk in response)
+            for chunk in chunks:
+                # stops reading once the request was cancelled or timed out
+                if request.done() or not request._append(chunk):
+                    return
+            if request._finish("done") and self.cache is not None and request.key is not None:
+                self.cache.put(request.key, request.text, request.kind)
+        except Exception as e:
+            request._finish("failed", e)
+        finally:
+            self._forget(request)
+
+    def _forget(self, request):
+        with self._lock:
+            if request.key is not None and self._inflight.get(request.key) is request:
+                del self._inflight[request.key]
+
+    def inflight(self):
+        with self._lock:
+            return [request for request in self._inflight.values() if not request.done()]
+
+    def close(self, wait=False):
+        for request in self.inflight():
+            request.cancel()
+        self._pool.shutdown(wait=wait)
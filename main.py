@@ -1,4 +1,7 @@
 from heartrate_monitor import HeartRateMonitor
+from hrcalc import EstimatorConfig
+from sensor_interrupts import GPIOInterrupt
+from max30102_sim import SimulatedBus, SyntheticPPG, ReplaySource, BusInterrupt
 import time
 import argparse
 
@@ -7,10 +10,43 @@ parser.add_argument("-r", "--raw", action="store_true",
                     help="print raw data instead of calculation result")
 parser.add_argument("-t", "--time", type=int, default=30,
                     help="duration in seconds to read from sensor, default 30")
+parser.add_argument("-i", "--int-pin", type=int, default=None,
+                    help="BCM GPIO pin wired to the sensor INT line; waits on it instead of polling")
+parser.add_argument("-s", "--stats", action="store_true",
+                    help="periodically print FIFO throughput and overflow counters")
+parser.add_argument("--simulate", action="store_true",
+                    help="use a simulated sensor with a synthetic 72 bpm / 97%% SpO2 signal")
+parser.add_argument("--replay", default=None,
+                    help="use a simulated sensor that replays a --raw recording")
+parser.add_argument("--rate", type=float, default=25,
+                    help="samples per second out of the sensor FIFO, default 25")
+parser.add_argument("--window", type=float, default=4.0,
+                    help="estimation window in seconds, default 4")
+parser.add_argument("--hop", type=float, default=None,
+                    help="seconds between estimates, default every new sample")
 args = parser.parse_args()
 
+config = EstimatorConfig.for_rate(args.rate, args.window, args.hop)
+
+bus = None
+if args.replay:
+    bus = SimulatedBus(ReplaySource(args.replay))
+elif args.simulate:
+    bus = SimulatedBus(SyntheticPPG())
+
+interrupt = None
+if args.int_pin is not None:
+    # a simulated sensor has its own INT line, the pin number is not used
+    interrupt = BusInterrupt(bus) if bus is not None else GPIOInterrupt(args.int_pin)
+
+try:
+    hrm = HeartRateMonitor(print_raw=args.raw, print_result=(not args.raw), interrupt=interrupt,
+                           print_stats=args.stats, bus=bus, config=config)
+except ValueError as e:
+    if interrupt is not None:
+        interrupt.close()
+    parser.error("--rate: {0}".format(e))
 print('sensor starting...')
-hrm = HeartRateMonitor(print_raw=args.raw, print_result=(not args.raw))
 hrm.start_sensor()
 try:
     time.sleep(args.time)
@@ -18,4 +54,8 @@ except KeyboardInterrupt:
     print('keyboard interrupt detected, exiting...')
 
 hrm.stop_sensor()
+if args.stats and hrm.stats is not None:
+    print("FIFO {0}".format(hrm.stats.summary()))
+if interrupt is not None:
+    interrupt.close()
 print('sensor stoped!')
\ No newline at end of file
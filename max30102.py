@@ -2,8 +2,14 @@
 
 # this code is currently for python 2.7
 from __future__ import print_function
-from time import sleep
-import smbus
+from time import sleep, monotonic
+import numpy as np
+
+try:
+    import smbus
+except ImportError:
+    # not on a Pi; MAX30102 then needs an explicit bus (see max30102_sim)
+    smbus = None
 
 # register addresses
 REG_INTR_STATUS_1 = 0x00
@@ -34,14 +40,100 @@ REG_PROX_INT_THRESH = 0x30
 REG_REV_ID = 0xFE
 REG_PART_ID = 0xFF
 
+# REG_INTR_ENABLE_1 bits
+INTR_A_FULL = 0x80
+INTR_PPG_RDY = 0x40
+INTR_ALC_OVF = 0x20
+
+# the FIFO holds 32 samples of 6 bytes each in SpO2 mode (3 red + 3 ir)
+FIFO_DEPTH = 32
+BYTES_PER_SAMPLE = 6
+# largest block one SMBus transfer can carry (I2C_SMBUS_BLOCK_MAX)
+SMBUS_BLOCK_MAX = 32
+SAMPLES_PER_BLOCK = SMBUS_BLOCK_MAX // BYTES_PER_SAMPLE
+
+# SPO2_SR[4:2] of REG_SPO2_CONFIG, in samples per second
+SPO2_SAMPLE_RATES = (50, 100, 200, 400, 800, 1000, 1600, 3200)
+# SMP_AVE[7:5] of REG_FIFO_CONFIG, samples averaged into one FIFO entry
+FIFO_SAMPLE_AVERAGES = (1, 2, 4, 8, 16, 32, 32, 32)
+
+
+class FifoStats(object):
+    """
+    Running FIFO counters: samples read, overflow events and samples the
+    sensor dropped while its FIFO was full.
+    """
+
+    def __init__(self, configured_rate=None):
+        self.configured_rate = configured_rate
+        self.reset()
+
+    def reset(self):
+        self.samples_read = 0
+        self.reads = 0
+        self.overflow_events = 0
+        self.samples_lost = 0
+        self.started = monotonic()
+
+    @property
+    def elapsed(self):
+        return monotonic() - self.started
+
+    def effective_rate(self):
+        """
+        Samples actually read per second since the last reset.
+        """
+        elapsed = self.elapsed
+        return self.samples_read / elapsed if elapsed > 0 else 0.0
+
+    def loss_ratio(self):
+        total = self.samples_read + self.samples_lost
+        return self.samples_lost / float(total) if total else 0.0
+
+    def summary(self):
+        configured = "{0:.1f}/s".format(self.configured_rate) if self.configured_rate else "unknown"
+        per_read = self.samples_read / float(self.reads) if self.reads else 0.0
+        return ("samples: {0} in {1:.1f}s ({2:.1f}/s, configured {3}), "
+                "reads: {4} ({5:.1f} samples/read), "
+                "overflows: {6}, lost: {7} ({8:.2%})").format(
+                    self.samples_read, self.elapsed, self.effective_rate(), configured,
+                    self.reads, per_read,
+                    self.overflow_events, self.samples_lost, self.loss_ratio())
+
+
+def output_rate_settings(rate):
+    """
+    (SPO2_SR, SMP_AVE) that make the FIFO fill at `rate` samples per second,
+    preferring 4x averaging like setup() and sample rates up to 400 Hz (the
+    fastest the 411uS LED pulse width allows). Raises ValueError for rates
+    no combination produces.
+    """
+    combos = [(sr, avg) for sr in SPO2_SAMPLE_RATES for avg in sorted(set(FIFO_SAMPLE_AVERAGES))
+              if sr == rate * avg]
+    if not combos:
+        raise ValueError("{0} samples/s cannot be produced by SPO2_SR / SMP_AVE".format(rate))
+    combos.sort(key=lambda c: (c[0] > 400, c[1] != 4, -c[1]))
+    return combos[0]
+
 
 class MAX30102():
-    # by default, this assumes that the device is at 0x57 on channel 1
-    def __init__(self, channel=1, address=0x57):
+    # by default, this assumes that the device is at 0x57 on channel 1.
+    # `bus` replaces smbus.SMBus(channel), e.g. with max30102_sim.SimulatedBus
+    def __init__(self, channel=1, address=0x57, bus=None):
         #print("Channel: {0}, address: {1}".format(channel, address))
         self.address = address
         self.channel = channel
-        self.bus = smbus.SMBus(self.channel)
+        if bus is None:
+            if smbus is None:
+                raise ImportError("smbus is not installed, pass a bus object instead")
+            bus = smbus.SMBus(self.channel)
+        self.bus = bus
+        self.stats = FifoStats()
+        # sensor sample rate and FIFO averaging, filled in by setup()
+        self.sample_rate = None
+        self.sample_average = None
+        # overflow count already booked since the last sample was popped
+        self._ovf_seen = 0
 
         self.reset()
 
@@ -85,13 +177,13 @@ class MAX30102():
 
         # 0b 0100 1111
         # sample avg = 4, fifo rollover = false, fifo almost full = 17
-        self.bus.write_i2c_block_data(self.address, REG_FIFO_CONFIG, [0x4f])
+        self.set_config(REG_FIFO_CONFIG, [0x4f])
 
         # 0x02 for read-only, 0x03 for SpO2 mode, 0x07 multimode LED
         self.bus.write_i2c_block_data(self.address, REG_MODE_CONFIG, [led_mode])
         # 0b 0010 0111
         # SPO2_ADC range = 4096nA, SPO2 sample rate = 100Hz, LED pulse-width = 411uS
-        self.bus.write_i2c_block_data(self.address, REG_SPO2_CONFIG, [0x27])
+        self.set_config(REG_SPO2_CONFIG, [0x27])
 
         # choose value for ~7mA for LED1
         self.bus.write_i2c_block_data(self.address, REG_LED1_PA, [0x24])
@@ -100,21 +192,83 @@ class MAX30102():
         # choose value fro ~25mA for Pilot LED
         self.bus.write_i2c_block_data(self.address, REG_PILOT_PA, [0x7f])
 
+    def enable_interrupts(self, a_full=True, ppg_rdy=False):
+        """
+        Choose which events pull INT low. With only A_FULL enabled the line
+        fires once the FIFO is almost full (17 samples with the setup() config)
+        instead of on every new sample.
+        """
+        value = 0x00
+        if a_full:
+            value |= INTR_A_FULL
+        if ppg_rdy:
+            value |= INTR_PPG_RDY
+        self.bus.write_i2c_block_data(self.address, REG_INTR_ENABLE_1, [value])
+        # reading the status registers releases INT if it is already asserted
+        self.bus.read_i2c_block_data(self.address, REG_INTR_STATUS_1, 2)
+
+    def set_output_rate(self, rate):
+        """
+        Pick SPO2_SR and SMP_AVE so that the FIFO fills at `rate` samples
+        per second (see output_rate_settings). Other bits of both registers
+        are left as they are.
+        """
+        sr, avg = output_rate_settings(rate)
+
+        spo2_config = self.bus.read_i2c_block_data(self.address, REG_SPO2_CONFIG, 1)[0]
+        fifo_config = self.bus.read_i2c_block_data(self.address, REG_FIFO_CONFIG, 1)[0]
+        spo2_config = (spo2_config & ~0x1C) | (SPO2_SAMPLE_RATES.index(sr) << 2)
+        fifo_config = (fifo_config & ~0xE0) | (FIFO_SAMPLE_AVERAGES.index(avg) << 5)
+        self.set_config(REG_SPO2_CONFIG, [spo2_config & 0xFF])
+        self.set_config(REG_FIFO_CONFIG, [fifo_config & 0xFF])
+
     # this won't validate the arguments!
     # use when changing the values from default
     def set_config(self, reg, value):
         self.bus.write_i2c_block_data(self.address, reg, value)
+        # keep track of the rate settings for the FIFO stats
+        if reg == REG_SPO2_CONFIG:
+            self.sample_rate = SPO2_SAMPLE_RATES[(value[0] >> 2) & 0x07]
+        elif reg == REG_FIFO_CONFIG:
+            self.sample_average = FIFO_SAMPLE_AVERAGES[(value[0] >> 5) & 0x07]
+        if self.sample_rate and self.sample_average:
+            self.stats.configured_rate = self.sample_rate / float(self.sample_average)
+
+    def read_fifo_pointers(self):
+        """
+        Read FIFO_WR_PTR, OVF_COUNTER and FIFO_RD_PTR in one transfer,
+        they sit in consecutive registers.
+        """
+        write_ptr, ovf_counter, read_ptr = self.bus.read_i2c_block_data(self.address, REG_FIFO_WR_PTR, 3)
+        return write_ptr, ovf_counter, read_ptr
+
+    def _record_overflow(self, ovf_counter):
+        """
+        Book samples dropped since the last pop. OVF_COUNTER keeps counting
+        (up to 31) while the FIFO stays full and is cleared by the next pop.
+        """
+        if ovf_counter > self._ovf_seen:
+            if self._ovf_seen == 0:
+                self.stats.overflow_events += 1
+            self.stats.samples_lost += ovf_counter - self._ovf_seen
+            self._ovf_seen = ovf_counter
+
+    def _record_read(self, num_samples):
+        self.stats.samples_read += num_samples
+        self.stats.reads += 1
+        self._ovf_seen = 0
 
     def get_data_present(self):
-        read_ptr = self.bus.read_byte_data(self.address, REG_FIFO_RD_PTR)
-        write_ptr = self.bus.read_byte_data(self.address, REG_FIFO_WR_PTR)
+        write_ptr, ovf_counter, read_ptr = self.read_fifo_pointers()
+        self._record_overflow(ovf_counter)
         if read_ptr == write_ptr:
-            return 0
+            # equal pointers also mean a full FIFO once samples were dropped
+            return FIFO_DEPTH if ovf_counter > 0 else 0
         else:
             num_samples = write_ptr - read_ptr
             # account for pointer wrap around
             if num_samples < 0:
-                num_samples += 32
+                num_samples += FIFO_DEPTH
             return num_samples
 
     def read_fifo(self):
@@ -134,9 +288,38 @@ class MAX30102():
         # mask MSB [23:18]
         red_led = (d[0] << 16 | d[1] << 8 | d[2]) & 0x03FFFF
         ir_led = (d[3] << 16 | d[4] << 8 | d[5]) & 0x03FFFF
+        self._record_read(1)
 
         return red_led, ir_led
 
+    def read_fifo_burst(self, max_samples=FIFO_DEPTH):
+        """
+        Read all samples waiting in the FIFO with as few I2C transfers as
+        the SMBus block limit allows.
+        Returns an (n, 2) array of (red, ir) rows, oldest sample first.
+        """
+        num_samples = min(self.get_data_present(), max_samples)
+        if num_samples == 0:
+            return np.empty((0, 2), dtype=np.int64)
+
+        # read & clear both interrupt registers at once (values are discarded)
+        self.bus.read_i2c_block_data(self.address, REG_INTR_STATUS_1, 2)
+
+        # FIFO_DATA does not auto-increment, so consecutive reads
+        # keep popping samples
+        data = []
+        remaining = num_samples
+        while remaining > 0:
+            chunk = min(remaining, SAMPLES_PER_BLOCK)
+            data.extend(self.bus.read_i2c_block_data(self.address, REG_FIFO_DATA, chunk * BYTES_PER_SAMPLE))
+            remaining -= chunk
+
+        # 3 bytes per channel, mask MSB [23:18]
+        d = np.asarray(data, dtype=np.int64).reshape(-1, 3)
+        values = (d[:, 0] << 16 | d[:, 1] << 8 | d[:, 2]) & 0x03FFFF
+        self._record_read(num_samples)
+        return values.reshape(-1, 2)
+
     def read_sequential(self, amount=100):
         """
         This function will read the red-led and ir-led `amount` times.
@@ -146,13 +329,9 @@ class MAX30102():
         ir_buf = []
         count = amount
         while count > 0:
-            num_bytes = self.get_data_present()
-            while num_bytes > 0:
-                red, ir = self.read_fifo()
-
-                red_buf.append(red)
-                ir_buf.append(ir)
-                num_bytes -= 1
-                count -= 1
+            samples = self.read_fifo_burst()
+            red_buf.extend(samples[:, 0].tolist())
+            ir_buf.extend(samples[:, 1].tolist())
+            count -= samples.shape[0]
 
         return red_buf, ir_buf
@@ -0,0 +1,495 @@
+# -*-coding:utf-8-*-
+
+# Off-device stand-in for the MAX30102 and its I2C bus.
+#
+# SimulatedBus answers the smbus calls the driver makes and emulates the
+# sensor FIFO (write/read pointers, overflow counter, rollover and the
+# interrupt flags) on top of a sample source, so MAX30102, HeartRateMonitor
+# and hrcalc can run on any Linux box:
+#
+#   bus = SimulatedBus(SyntheticPPG(hr=80, spo2=96))
+#   hrm = HeartRateMonitor(print_result=True, bus=bus)
+#
+# Running this file drives HeartRateMonitor against the simulator and
+# prints throughput, bus usage and sample latency.
+from __future__ import print_function
+import argparse
+import math
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from max30102 import (
+    REG_INTR_STATUS_1, REG_INTR_STATUS_2, REG_INTR_ENABLE_1, REG_INTR_ENABLE_2,
+    REG_FIFO_WR_PTR, REG_OVF_COUNTER, REG_FIFO_RD_PTR, REG_FIFO_DATA,
+    REG_FIFO_CONFIG, REG_MODE_CONFIG, REG_SPO2_CONFIG, REG_PART_ID,
+    INTR_A_FULL, INTR_PPG_RDY, FIFO_DEPTH,
+    SPO2_SAMPLE_RATES, FIFO_SAMPLE_AVERAGES,
+)
+from sensor_interrupts import InterruptBackend
+
+PART_ID = 0x15
+# REG_INTR_STATUS_1 power ready flag
+INTR_PWR_RDY = 0x01
+
+
+class SyntheticPPG(object):
+    """
+    Endless PPG source with a known heart rate and SpO2.
+    The red AC/DC ratio is derived from the calibration curve in hrcalc,
+    so a clean signal should come back as the configured `spo2`.
+    `noise` is the standard deviation of white noise in ADC counts,
+    `motion` (0 to ~1) scales baseline wander and random motion bumps.
+    """
+
+    def __init__(self, hr=72.0, spo2=97.0, sample_rate=25.0, noise=10.0, motion=0.0,
+                 ir_dc=100000.0, red_dc=90000.0, ir_ac=400.0, seed=None):
+        self.hr = hr
+        self.spo2 = spo2
+        self.sample_rate = sample_rate
+        self.noise = noise
+        self.motion = motion
+        self.ir_dc = ir_dc
+        self.red_dc = red_dc
+        self.ir_ac = ir_ac
+        self._rng = np.random.default_rng(seed)
+        self._phase = 0.0
+        self._t = 0.0
+        self._wander_phase = self._rng.uniform(0, 2 * math.pi)
+        self._bump_left = 0
+        self._bump_amp = 0.0
+
+    @staticmethod
+    def ratio_for_spo2(spo2):
+        """
+        AC/DC ratio R that hrcalc maps to `spo2`, from
+        spo2 = -45.060 r^2 / 10000 + 30.054 r / 100 + 94.845 with r = 100 R.
+        Uses the branch where the ratio rises as SpO2 falls.
+        """
+        a = -45.060 / 10000.0
+        b = 30.054 / 100.0
+        c = 94.845 - spo2
+        disc = max(b * b - 4 * a * c, 0.0)
+        return (-b - math.sqrt(disc)) / (2 * a) / 100.0
+
+    @property
+    def red_ac(self):
+        return self.ratio_for_spo2(self.spo2) * self.red_dc * self.ir_ac / self.ir_dc
+
+    def read(self, n):
+        """
+        Next `n` samples as an (n, 2) int array of (red, ir).
+        """
+        step = np.arange(1, n + 1)
+        phase = self._phase + step * (self.hr / 60.0) / self.sample_rate
+        t = self._t + step / float(self.sample_rate)
+        self._phase = phase[-1] % 1.0 if n else self._phase
+        self._t = t[-1] if n else self._t
+
+        # one sharp pulse per beat, blood volume lowers the raw reading
+        pulse = ((1.0 - np.cos(2 * math.pi * phase)) / 2.0) ** 2
+        ir = self.ir_dc - self.ir_ac * pulse
+        red = self.red_dc - self.red_ac * pulse
+
+        if self.motion > 0:
+            artifact = self.motion * 3 * self.ir_ac * np.sin(2 * math.pi * 0.3 * t + self._wander_phase)
+            artifact += self._bumps(n)
+            ir = ir + artifact
+            red = red + artifact * self.red_dc / self.ir_dc
+        if self.noise > 0:
+            ir = ir + self._rng.normal(0, self.noise, n)
+            red = red + self._rng.normal(0, self.noise, n)
+
+        samples = np.empty((n, 2), dtype=np.int64)
+        samples[:, 0] = np.clip(red, 0, 0x3FFFF)
+        samples[:, 1] = np.clip(ir, 0, 0x3FFFF)
+        return samples
+
+    def _bumps(self, n):
+        """
+        Half-second motion bumps starting at random samples.
+        """
+        out = np.zeros(n)
+        length = max(1, int(self.sample_rate / 2))
+        i = 0
+        while i < n:
+            if self._bump_left == 0:
+                if self._rng.random() >= self.motion * 0.01:
+                    i += 1
+                    continue
+                self._bump_left = length
+                self._bump_amp = self._rng.choice([-1, 1]) * self.motion * 5 * self.ir_ac
+            take = min(self._bump_left, n - i)
+            done = length - self._bump_left
+            out[i:i + take] = self._bump_amp * np.sin(math.pi * (done + np.arange(take)) / length)
+            self._bump_left -= take
+            i += take
+        return out
+
+
+class ReplaySource(object):
+    """
+    Plays back a recording with one "ir, red" pair per line, which is what
+    `main.py --raw` prints. Lines that are not two numbers are skipped.
+    With loop=False the source runs dry at the end of the file.
+    """
+
+    def __init__(self, path, loop=True):
+        rows = []
+        with open(path) as f:
+            for line in f:
+                parts = line.replace(",", " ").split()
+                if len(parts) != 2:
+                    continue
+                try:
+                    ir, red = int(float(parts[0])), int(float(parts[1]))
+                except ValueError:
+                    continue
+                rows.append((red, ir))
+        if not rows:
+            raise ValueError("no samples found in {0}".format(path))
+        self.path = path
+        self.loop = loop
+        self._data = np.array(rows, dtype=np.int64)
+        self._pos = 0
+
+    def __len__(self):
+        return self._data.shape[0]
+
+    def read(self, n):
+        out = []
+        while n > 0:
+            if self._pos >= self._data.shape[0]:
+                if not self.loop:
+                    break
+                self._pos = 0
+            chunk = self._data[self._pos:self._pos + n]
+            out.append(chunk)
+            self._pos += chunk.shape[0]
+            n -= chunk.shape[0]
+        return np.concatenate(out) if out else np.empty((0, 2), dtype=np.int64)
+
+
+class SimulatedBus(object):
+    """
+    smbus.SMBus look-alike with a simulated MAX30102 at `address`.
+
+    With realtime=True samples appear at the configured output rate
+    (SPO2_SR / SMP_AVE) times `speed` of wall-clock time. With
+    realtime=False they only appear through advance(). `i2c_clock` (Hz)
+    adds the transfer time of every transaction, approximately.
+    """
+
+    def __init__(self, source=None, address=0x57, speed=1.0, realtime=True, i2c_clock=None):
+        self.source = source if source is not None else SyntheticPPG()
+        self.address = address
+        self.speed = speed
+        self.realtime = realtime
+        self.i2c_clock = i2c_clock
+        self.transactions = 0
+        self.bytes_transferred = 0
+        self.samples_produced = 0
+        self.samples_dropped = 0
+        # sample age when popped, in simulated seconds
+        self.latencies = deque(maxlen=100000)
+        self._lock = threading.RLock()
+        self._sim_time = 0.0
+        self._clock = time.monotonic()
+        self._power_on_reset()
+
+    # ---- chip state ----
+
+    def _power_on_reset(self):
+        self._regs = bytearray(256)
+        self._regs[REG_PART_ID] = PART_ID
+        self._regs[REG_INTR_STATUS_1] = INTR_PWR_RDY
+        self._fifo = np.zeros((FIFO_DEPTH, 2), dtype=np.int64)
+        self._fifo_time = np.zeros(FIFO_DEPTH)
+        self._wr = 0
+        self._rd = 0
+        self._ovf = 0
+        self._count = 0
+        self._pending = []
+        self._backlog = 0.0
+
+    @property
+    def sample_rate(self):
+        """
+        FIFO output rate in samples per second.
+        """
+        rate = SPO2_SAMPLE_RATES[(self._regs[REG_SPO2_CONFIG] >> 2) & 0x07]
+        return rate / float(FIFO_SAMPLE_AVERAGES[(self._regs[REG_FIFO_CONFIG] >> 5) & 0x07])
+
+    @property
+    def sampling(self):
+        mode = self._regs[REG_MODE_CONFIG]
+        return not mode & 0x80 and (mode & 0x07) in (0x02, 0x03, 0x07)
+
+    @property
+    def a_full_level(self):
+        # FIFO_A_FULL[3:0] is the number of free slots left when A_FULL fires
+        return FIFO_DEPTH - (self._regs[REG_FIFO_CONFIG] & 0x0F)
+
+    @property
+    def fifo_count(self):
+        with self._lock:
+            self._update()
+            return self._count
+
+    def _update(self):
+        if not self.realtime:
+            return
+        now = time.monotonic()
+        elapsed = (now - self._clock) * self.speed
+        self._clock = now
+        self._advance_time(elapsed)
+
+    def _advance_time(self, seconds):
+        self._sim_time += seconds
+        if not self.sampling:
+            self._backlog = 0.0
+            return
+        self._backlog += seconds * self.sample_rate
+        n = int(self._backlog)
+        if n > 0:
+            self._backlog -= n
+            self._produce(n)
+
+    def _produce(self, n):
+        if hasattr(self.source, "sample_rate"):
+            self.source.sample_rate = self.sample_rate
+        samples = self.source.read(n)
+        n = samples.shape[0]
+        if n == 0:
+            return
+        times = self._sim_time - (n - 1 - np.arange(n)) / self.sample_rate
+        rollover = self._regs[REG_FIFO_CONFIG] & 0x10
+        self.samples_produced += n
+
+        for k in range(n):
+            if self._count == FIFO_DEPTH:
+                # full: samples are lost, or the oldest one is overwritten
+                self._ovf = min(self._ovf + 1, 0x1F)
+                self.samples_dropped += 1
+                if not rollover:
+                    continue
+                self._rd = (self._rd + 1) % FIFO_DEPTH
+                self._count -= 1
+            self._fifo[self._wr] = samples[k]
+            self._fifo_time[self._wr] = times[k]
+            self._wr = (self._wr + 1) % FIFO_DEPTH
+            self._count += 1
+
+        self._regs[REG_INTR_STATUS_1] |= INTR_PPG_RDY
+        if self._count >= self.a_full_level:
+            self._regs[REG_INTR_STATUS_1] |= INTR_A_FULL
+
+    def _pop_bytes(self):
+        if self._count == 0:
+            return [0] * 6
+        red, ir = self._fifo[self._rd]
+        self.latencies.append(self._sim_time - self._fifo_time[self._rd])
+        self._rd = (self._rd + 1) % FIFO_DEPTH
+        self._count -= 1
+        self._ovf = 0
+        red = int(red)
+        ir = int(ir)
+        return [(red >> 16) & 0xFF, (red >> 8) & 0xFF, red & 0xFF,
+                (ir >> 16) & 0xFF, (ir >> 8) & 0xFF, ir & 0xFF]
+
+    def _read_register(self, reg):
+        if reg == REG_FIFO_DATA:
+            if not self._pending:
+                self._pending = self._pop_bytes()
+            return self._pending.pop(0)
+        if reg == REG_FIFO_WR_PTR:
+            return self._wr
+        if reg == REG_OVF_COUNTER:
+            return self._ovf
+        if reg == REG_FIFO_RD_PTR:
+            return self._rd
+        value = self._regs[reg]
+        if reg in (REG_INTR_STATUS_1, REG_INTR_STATUS_2):
+            self._regs[reg] = 0  # cleared on read
+        return value
+
+    def _write_register(self, reg, value):
+        value &= 0xFF
+        if reg == REG_MODE_CONFIG and value & 0x40:
+            self._power_on_reset()
+        elif reg == REG_FIFO_WR_PTR:
+            self._wr = value & 0x1F
+            self._count = (self._wr - self._rd) % FIFO_DEPTH
+        elif reg == REG_FIFO_RD_PTR:
+            self._rd = value & 0x1F
+            self._count = (self._wr - self._rd) % FIFO_DEPTH
+            self._pending = []
+        elif reg == REG_OVF_COUNTER:
+            self._ovf = value & 0x1F
+        else:
+            self._regs[reg] = value
+
+    def _transfer(self, address, num_bytes):
+        if address != self.address:
+            raise IOError(121, "Remote I/O error")
+        self.transactions += 1
+        self.bytes_transferred += num_bytes
+        if self.i2c_clock:
+            # address + register byte + payload, 9 clocks per byte
+            time.sleep((num_bytes + 2) * 9.0 / self.i2c_clock)
+
+    # ---- smbus interface ----
+
+    def read_i2c_block_data(self, address, reg, length=32):
+        with self._lock:
+            self._transfer(address, length)
+            self._update()
+            # FIFO_DATA keeps its address, other registers auto-increment
+            if reg == REG_FIFO_DATA:
+                return [self._read_register(reg) for _ in range(length)]
+            return [self._read_register((reg + i) & 0xFF) for i in range(length)]
+
+    def write_i2c_block_data(self, address, reg, values):
+        with self._lock:
+            self._transfer(address, len(values))
+            self._update()
+            for i, value in enumerate(values):
+                self._write_register((reg + i) & 0xFF, value)
+
+    def read_byte_data(self, address, reg):
+        return self.read_i2c_block_data(address, reg, 1)[0]
+
+    def write_byte_data(self, address, reg, value):
+        self.write_i2c_block_data(address, reg, [value])
+
+    def close(self):
+        pass
+
+    # ---- simulation control ----
+
+    def advance(self, num_samples):
+        """
+        Produce `num_samples` samples now (meant for realtime=False).
+        """
+        with self._lock:
+            self._sim_time += num_samples / self.sample_rate
+            if self.sampling and num_samples > 0:
+                self._produce(num_samples)
+
+    def interrupt_asserted(self):
+        """
+        True while an enabled interrupt flag is set, i.e. INT is pulled low.
+        """
+        with self._lock:
+            self._update()
+            enabled = self._regs[REG_INTR_ENABLE_1]
+            return bool(self._regs[REG_INTR_STATUS_1] & enabled) or \
+                bool(self._regs[REG_INTR_STATUS_2] & self._regs[REG_INTR_ENABLE_2])
+
+    def time_to_interrupt(self):
+        """
+        Wall-clock seconds until INT is pulled low, 0 if it already is and
+        None if it will not happen on its own.
+        """
+        with self._lock:
+            if self.interrupt_asserted():
+                return 0.0
+            if not self.realtime or not self.sampling or self.speed <= 0:
+                return None
+            enabled = self._regs[REG_INTR_ENABLE_1]
+            needed = []
+            if enabled & INTR_PPG_RDY:
+                needed.append(1)
+            if enabled & INTR_A_FULL:
+                needed.append(max(self.a_full_level - self._count, 1))
+            if not needed:
+                return None
+            samples = min(needed) - self._backlog
+            return max(samples, 0.0) / self.sample_rate / self.speed
+
+    def latency_percentiles(self, percentiles=(50, 95, 99)):
+        """
+        Sample age at read time in wall-clock seconds.
+        """
+        if not self.latencies:
+            return [float("nan")] * len(percentiles)
+        values = np.percentile(np.asarray(self.latencies), percentiles) / self.speed
+        return [float(v) for v in values]
+
+    def summary(self):
+        popped = self.samples_produced - self.samples_dropped
+        per_sample = self.transactions / float(popped) if popped else 0.0
+        p50, p95, p99 = self.latency_percentiles()
+        return ("bus: {0} transactions ({1:.2f}/sample), {2} bytes, "
+                "produced {3}, dropped {4}, latency p50/p95/p99 {5:.1f}/{6:.1f}/{7:.1f} ms").format(
+                    self.transactions, per_sample, self.bytes_transferred,
+                    self.samples_produced, self.samples_dropped,
+                    p50 * 1000, p95 * 1000, p99 * 1000)
+
+
+class BusInterrupt(InterruptBackend):
+    """
+    The INT line of a SimulatedBus, for HeartRateMonitor(interrupt=...).
+    """
+
+    def __init__(self, bus):
+        self.bus = bus
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.bus.time_to_interrupt()
+            if delay == 0:
+                return True
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            if delay is None and remaining is None:
+                # nothing will ever fire; behave like a line that stays high
+                delay = 1.0
+            time.sleep(min(d for d in (delay, remaining) if d is not None))
+
+
+def main():
+    from heartrate_monitor import HeartRateMonitor
+
+    parser = argparse.ArgumentParser(description="Run HeartRateMonitor against a simulated MAX30102")
+    parser.add_argument("-t", "--time", type=float, default=10,
+                        help="seconds of wall-clock time to run, default 10")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="simulated seconds per real second, default 1")
+    parser.add_argument("--hr", type=float, default=72, help="synthetic heart rate")
+    parser.add_argument("--spo2", type=float, default=97, help="synthetic SpO2")
+    parser.add_argument("--noise", type=float, default=10, help="noise std in ADC counts")
+    parser.add_argument("--motion", type=float, default=0, help="motion artifact level, 0-1")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--replay", default=None, help="replay a `main.py --raw` recording instead")
+    parser.add_argument("--i2c-clock", type=float, default=None, help="emulate transfer time at this I2C clock (Hz)")
+    parser.add_argument("--interrupt", action="store_true", help="wait on the simulated INT line")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print every estimate")
+    args = parser.parse_args()
+
+    if args.replay:
+        source = ReplaySource(args.replay)
+    else:
+        source = SyntheticPPG(hr=args.hr, spo2=args.spo2, noise=args.noise, motion=args.motion, seed=args.seed)
+    bus = SimulatedBus(source, speed=args.speed, i2c_clock=args.i2c_clock)
+    interrupt = BusInterrupt(bus) if args.interrupt else None
+
+    hrm = HeartRateMonitor(print_result=args.verbose, interrupt=interrupt, bus=bus)
+    hrm.start_sensor()
+    time.sleep(args.time)
+    bpm, spo2 = hrm.bpm, hrm.spo2
+    hrm.stop_sensor()
+
+    print("FIFO {0}".format(hrm.stats.summary()))
+    print(bus.summary())
+    print("estimates: {0}, bpm: {1:.1f}, spo2: {2:.1f}".format(hrm.estimates, bpm, spo2))
+    if not args.replay:
+        print("ground truth: bpm {0:.1f}, spo2 {1:.1f}".format(args.hr, args.spo2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import time
+
+import pandas as pd
+
+from health_db import from_epoch_ms
+
+# buckets per metric the summaries are computed from; a window of hours is
+# read from the rollups at this size rather than as raw samples
+FEATURE_POINTS = 360
+# context segments and anomalies listed per metric, newest kept
+MAX_SEGMENTS = 6
+MAX_ANOMALIES = 5
+
+
+def _round(value):
+    return None if value is None or pd.isna(value) else round(float(value), 2)
+
+
+def summarize_metric(df):
+    """
+    Compact summary of one metric's frame (see health_db.rows_to_frame):
+    mean/min/max, trend in units per hour, last value and the runs of
+    consecutive readings in the same context.
+    """
+    if df.empty:
+        return None
+    df = df.assign(Time=pd.to_datetime(df["Timestamp"])).sort_values("Time")
+    hours = (df["Time"] - df["Time"].iloc[0]).dt.total_seconds() / 3600.0
+    values = df["Value"]
+    spread = ((hours - hours.mean()) ** 2).sum()
+    slope = ((hours - hours.mean()) * (values - values.mean())).sum() / spread if spread else 0.0
+
+    # a rollup bucket has one row per context seen in it; taking the
+    # context of the running segment first keeps a bucket where the activity
+    # changed from splitting the segments into one-bucket pieces
+    runs = []
+    for when, bucket in df.groupby("Time", sort=True):
+        current = runs[-1][0] if runs else None
+        for context, value in sorted(zip(bucket["Context"], bucket["Value"]), key=lambda row: row[0] != current):
+            if runs and runs[-1][0] == context:
+                runs[-1][2] = when
+                runs[-1][3].append(value)
+            else:
+                runs.append([context, when, when, [value]])
+    segments = [{"context": context, "from": start.strftime("%H:%M"), "to": stop.strftime("%H:%M"),
+                 "mean": _round(sum(run) / len(run))} for context, start, stop, run in runs]
+
+    return {
+        "from": df["Time"].iloc[0].strftime("%Y-%m-%d %H:%M"),
+        "to": df["Time"].iloc[-1].strftime("%Y-%m-%d %H:%M"),
+        "mean": _round(values.mean()),
+        "min": _round(df["Min"].min()),
+        "max": _round(df["Max"].max()),
+        "slope_per_hour": _round(slope),
+        "last": _round(values.iloc[-1]),
+        "segments": segments[-MAX_SEGMENTS:],
+        "anomalies": [],
+    }
+
+
+def build_prompt_features(cache, metrics, hours=1.0, end=None, max_points=FEATURE_POINTS):
+    """
+    {metric: summary} over the `hours` up to end (epoch ms, default now),
+    read through a HealthDataCache. Insight events in the window are listed
+    as anomalies of their metric.
+    """
+    end = int(time.time() * 1000) if end is None else end
+    features = {}
+    for metric in metrics:
+        summary = summarize_metric(cache.history(metric, hours, end=end, max_points=max_points))
+        if summary is not None:
+            features[metric] = summary
+    since = end - int(hours * 3600 * 1000)
+    # recent_events is newest first
+    for event in cache.recent_events(within=hours * 3600):
+        summary = features.get(event.metric)
+        if summary is not None and since <= event.ts <= end and len(summary["anomalies"]) < MAX_ANOMALIES:
+            summary["anomalies"].append({
+                "kind": event.kind,
+                "value": _round(event.value),
+                "baseline": _round(event.baseline),
+                "at": pd.Timestamp(from_epoch_ms(event.ts)).strftime("%H:%M"),
+                "context": event.context,
+            })
+    return features
+
+
+def format_features(features):
+    """
+    The summaries as a few lines of text for a prompt.
+    """
+    lines = []
+    for metric, f in features.items():
+        line = (f"{metric} ({f['from']} to {f['to']}): mean {f['mean']}, min {f['min']}, max {f['max']}, "
+                f"trend {f['slope_per_hour']:+}/h, last {f['last']}")
+        if f["segments"]:
+            line += "; by activity: " + ", ".join(f"{s['context']} {s['from']}-{s['to']} mean {s['mean']}"
+                                                  for s in f["segments"])
+        if f["anomalies"]:
+            line += "; anomalies: " + ", ".join(f"{a['kind']} to {a['value']} (from {a['baseline']}) at {a['at']} "
+                                                f"while {a['context']}" for a in f["anomalies"])
+        lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,88 @@
+# -*-coding:utf-8-*-
+
+# Backends that block until the MAX30102 pulls its INT line low.
+# HeartRateMonitor takes one of these to sleep between FIFO drains
+# instead of polling the FIFO pointers every LOOP_TIME.
+import threading
+import time
+
+
+class InterruptBackend(object):
+    """
+    Base class for "wait for interrupt" backends.
+    """
+
+    def wait(self, timeout=None):
+        """
+        Block until the interrupt fires or `timeout` seconds pass.
+        Returns True if the interrupt fired.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class GPIOInterrupt(InterruptBackend):
+    """
+    Waits for a falling edge on the GPIO pin wired to INT (BCM numbering).
+    INT is open-drain and active low, so the internal pull-up is on by default.
+    """
+
+    def __init__(self, pin, pull_up=True):
+        # only available on the Pi itself
+        import RPi.GPIO as GPIO
+
+        self._gpio = GPIO
+        self.pin = pin
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_UP if pull_up else GPIO.PUD_OFF)
+
+    def wait(self, timeout=None):
+        GPIO = self._gpio
+        # INT stays low until the status registers are read, so an interrupt
+        # raised before we got here will not produce another edge
+        if GPIO.input(self.pin) == GPIO.LOW:
+            return True
+        if timeout is None:
+            channel = GPIO.wait_for_edge(self.pin, GPIO.FALLING)
+        else:
+            channel = GPIO.wait_for_edge(self.pin, GPIO.FALLING, timeout=max(1, int(timeout * 1000)))
+        return channel is not None
+
+    def close(self):
+        self._gpio.cleanup(self.pin)
+
+
+class SimulatedInterrupt(InterruptBackend):
+    """
+    Software interrupt for running without hardware.
+    Call trigger() to fire it by hand, or pass `period` (seconds) to have it
+    fire on a fixed schedule like a FIFO filling up at a constant rate.
+    """
+
+    def __init__(self, period=None):
+        self.period = period
+        self.fired = 0
+        self._event = threading.Event()
+        self._next_fire = time.monotonic() + period if period else None
+
+    def trigger(self):
+        self._event.set()
+
+    def wait(self, timeout=None):
+        now = time.monotonic()
+        wake_at = None if timeout is None else now + timeout
+        if self._next_fire is not None and (wake_at is None or self._next_fire < wake_at):
+            wake_at = self._next_fire
+
+        fired = self._event.wait(None if wake_at is None else max(0.0, wake_at - now))
+        self._event.clear()
+        if self._next_fire is not None and time.monotonic() >= self._next_fire:
+            fired = True
+            # skip over missed periods instead of firing a burst of them
+            while self._next_fire <= time.monotonic():
+                self._next_fire += self.period
+        if fired:
+            self.fired += 1
+        return fired